@@ -1,50 +1,269 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, g
 from functools import wraps
-from models import Database, ProjectModel, PromptModel, PromptVersionModel, UserModel, GroupModel, UserGroupModel, ProjectPermissionModel, ApiKeyModel, TagModel
+import atexit
+import gzip
+import hashlib
+import json
+import os
+from cache import LRUCache
+from events import ChangeBroadcaster, MAX_SUBSCRIBERS, RETRY_MS, SUBSCRIBER_QUEUE_SIZE, stream_events
+from models import Database, ProjectModel, PromptModel, PromptVersionModel, PromptLabelModel, UserModel, GroupModel, UserGroupModel, ProjectPermissionModel, ApiKeyModel, TagModel, ChangeModel, decode_cursor, encode_cursor, project_scope, to_beijing_timestamp
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时只使用 gzip
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
-db = Database()
+# PROMPTBOX_ENV=production 时启用 WAL 等多进程部署所需的数据库配置
+db = Database(
+    os.environ.get('PROMPTBOX_DB_PATH', 'prompts.db'),
+    production=os.environ.get('PROMPTBOX_ENV') == 'production',
+)
 project_model = ProjectModel(db)
 prompt_model = PromptModel(db)
 prompt_version_model = PromptVersionModel(db)
+prompt_label_model = PromptLabelModel(db)
 user_model = UserModel(db)
 group_model = GroupModel(db)
 user_group_model = UserGroupModel(db)
 project_permission_model = ProjectPermissionModel(db)
 api_key_model = ApiKeyModel(db)
 tag_model = TagModel(db)
+change_model = ChangeModel(db)
+
+# 变更推送：每个 worker 进程一个广播器，本进程提交写入后立即唤醒，其他进程的写入通过轮询变更日志获得
+# PROMPTBOX_MAX_STREAMS 限制本进程同时保持的 SSE 连接数，gunicorn.conf.py 按 worker_connections 设置
+change_broadcaster = ChangeBroadcaster(
+    change_model, on_idle=db.release_connection,
+    max_subscribers=int(os.environ.get('PROMPTBOX_MAX_STREAMS', MAX_SUBSCRIBERS)),
+)
+db.change_listeners.append(change_broadcaster.notify)
+
+# 项目数据包：(project_id, 标签) -> (项目代数, ETag, gzip 压缩后的 JSON)，项目有写入后重新生成
+bundle_cache = LRUCache(64)
+
+atexit.register(db.close)
+# atexit 按注册的相反顺序执行：先写入 API Key 使用记录，再关闭连接池
+atexit.register(api_key_model.close)
+
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    # 每个请求只借用一个连接，请求结束后归还连接池
+    db.release_connection()
+
+
+ADMIN_GROUP_NAME = '管理员组'
+
+
+class SecurityContext:
+    """
+    单个请求内的身份与权限信息。用户、所属用户组和各项目的权限级别
+    在首次用到时查询一次，同一请求内后续的权限检查直接复用。
+    """
+
+    _UNRESOLVED = object()
+
+    def __init__(self):
+        self._user = self._UNRESOLVED
+        self._group_names = None
+        self._project_levels = {}
+
+    @property
+    def user_id(self):
+        if 'user_id' in session:
+            return session['user_id']
+        return self.user['id'] if self.user else None
+
+    @property
+    def user(self):
+        if self._user is self._UNRESOLVED:
+            self._user = self._resolve_user()
+        return self._user
+
+    @staticmethod
+    def _resolve_user():
+        if 'user_id' in session:
+            return user_model.get_by_id(session['user_id'])
+        
+        api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+        if api_key:
+            user = api_key_model.get_user_by_key(api_key)
+            if user:
+                return {
+                    'id': user['user_id'],
+                    'username': user['username'],
+                    'is_admin': user['is_admin']
+                }
+        
+        return None
+
+    @property
+    def is_admin(self):
+        return bool(self.user and self.user['is_admin'])
+
+    @property
+    def group_names(self):
+        if self._group_names is None:
+            user_id = self.user_id
+            groups = user_group_model.get_user_groups(user_id) if user_id else []
+            self._group_names = {grp['name'] for grp in groups}
+        return self._group_names
+
+    @property
+    def is_admin_or_in_admin_group(self):
+        return self.is_admin or ADMIN_GROUP_NAME in self.group_names
+
+    def project_level(self, project_id):
+        """当前用户对项目的权限级别：'readwrite'、'read' 或 None"""
+        if project_id not in self._project_levels:
+            user_id = self.user_id
+            self._project_levels[project_id] = (
+                project_permission_model.get_user_permission_level(user_id, project_id) if user_id else None
+            )
+        return self._project_levels[project_id]
+
+    def can_read(self, project_id):
+        return self.is_admin or self.project_level(project_id) is not None
+
+    def can_write(self, project_id):
+        return self.is_admin_or_in_admin_group or self.project_level(project_id) == 'readwrite'
+
+
+def security_context():
+    if 'security' not in g:
+        g.security = SecurityContext()
+    return g.security
 
 
 def get_current_user_id():
-    if 'user_id' in session:
-        return session['user_id']
-    
-    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
-    if api_key:
-        user = api_key_model.get_user_by_key(api_key)
-        if user:
-            return user['user_id']
-    
-    return None
+    return security_context().user_id
 
 
 def get_current_user():
-    if 'user_id' in session:
-        return user_model.get_by_id(session['user_id'])
-    
-    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
-    if api_key:
-        user = api_key_model.get_user_by_key(api_key)
-        if user:
-            return {
-                'id': user['user_id'],
-                'username': user['username'],
-                'is_admin': user['is_admin']
-            }
-    
-    return None
+    return security_context().user
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def get_page_args():
+    """解析 limit/cursor 分页参数；两者都未提供时返回 (None, None)，即不分页返回全部数据"""
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor') or None
+    if limit is None and cursor is None:
+        return None, None
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE)), cursor
+
+
+def get_fields_arg():
+    """
+    解析 fields=title,preview,... 字段投影参数，未提供时返回 (None, True) 表示返回全部字段。
+    'tags' 不是数据库列，单独返回是否需要附加标签。
+    """
+    fields = request.args.get('fields')
+    if fields is None:
+        return None, True
+    fields = [f.strip() for f in fields.split(',') if f.strip()]
+    with_tags = 'tags' in fields
+    return [f for f in fields if f != 'tags'], with_tags
+
+
+def get_as_of_arg():
+    """解析 as_of 时间参数（ISO 8601），返回北京时间字符串；缺失或格式错误时抛出 ValueError"""
+    as_of = request.args.get('as_of')
+    if not as_of:
+        raise ValueError('缺少 as_of 参数')
+    try:
+        return to_beijing_timestamp(as_of)
+    except ValueError:
+        raise ValueError('as_of 必须是 ISO 8601 格式的时间')
+
+
+def page_response(rows, next_cursor, limit):
+    result = {'success': True, 'data': rows}
+    if limit is not None:
+        result['next_cursor'] = next_cursor
+    return jsonify(result)
+
+
+# 版本内容不可变，按版本 id 寻址的响应可以被客户端永久缓存。
+# 响应需要登录且按权限返回，只允许浏览器等私有缓存保存：反向代理和 CDN 不一定遵守
+# Vary: Cookie，共享缓存会把内容返回给无权限的用户，撤销权限后也无法失效
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def immutable_response(response):
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = 'Cookie, X-API-Key'
+    return response
+
+
+# JSON 响应超过此字节数、且客户端支持时压缩；安装了 brotli 时优先使用 br
+COMPRESS_MIN_SIZE = 1024
+
+
+def project_etag(project_id, *validators):
+    """
+    由项目代数生成 ETag，不需要先查询数据、生成响应：项目下的提示词、版本、标签有任何写入都会使代数递增。
+    请求路径和参数、当前用户，以及随用户变化的字段（如 can_edit）一并计入。
+    """
+    key = (request.full_path, get_current_user_id(), db.get_generation(project_scope(project_id)), validators)
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+
+
+def is_fresh(etag):
+    """客户端缓存的版本仍然有效（If-None-Match 匹配）"""
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    return revalidate_response(app.response_class(status=304), etag)
+
+
+def revalidate_response(response, etag):
+    """客户端可以缓存响应，但每次使用前需带 If-None-Match 向服务器确认"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if brotli is not None and 'br' in request.accept_encodings:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(data, compresslevel=6, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    # 压缩后的字节与原始响应不同，强 ETag 降为弱 ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def attach_tags(prompts):
+    """为提示词列表批量附加标签"""
+    tags_by_prompt = tag_model.get_tags_for_prompts([p['id'] for p in prompts])
+    for p in prompts:
+        p['tags'] = tags_by_prompt[p['id']]
+    return prompts
 
 
 def login_required(f):
@@ -62,8 +281,7 @@ def login_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user = get_current_user()
-        if not user or not user['is_admin']:
+        if not is_admin():
             if request.is_json:
                 return jsonify({'success': False, 'error': '没有权限'}), 403
             return render_template('no_permission.html')
@@ -72,28 +290,21 @@ def admin_required(f):
 
 
 def is_admin():
-    user = get_current_user()
-    return user and user['is_admin']
+    return security_context().is_admin
 
 
 def is_admin_or_in_admin_group():
-    if is_admin():
-        return True
-    user_id = get_current_user_id()
-    if not user_id:
-        return False
-    user_groups = user_group_model.get_user_groups(user_id)
-    return any(g['name'] == '管理员组' for g in user_groups)
+    return security_context().is_admin_or_in_admin_group
+
+
+def can_read_project(project_id):
+    """检查当前用户是否有项目读权限"""
+    return security_context().can_read(project_id)
 
 
 def can_write_project(project_id):
     """检查当前用户是否有项目写权限"""
-    if is_admin_or_in_admin_group():
-        return True
-    user_id = get_current_user_id()
-    if not user_id:
-        return False
-    return project_permission_model.check_user_can_write(user_id, project_id)
+    return security_context().can_write(project_id)
 
 
 @app.route('/')
@@ -253,19 +464,100 @@ def api_search():
         return jsonify({'success': True, 'data': []})
     
     keywords = q.split()
+    limit, cursor = get_page_args()
+    fields, _ = get_fields_arg()
     
     # 权限控制：普通用户只能搜索有权限的项目
-    if is_admin():
-        results = prompt_model.search(keywords)
-    else:
+    project_ids = None
+    if not is_admin():
         user_id = get_current_user_id()
         user_projects = project_permission_model.get_user_projects(user_id)
         project_ids = [p['id'] for p in user_projects]
         if not project_ids:
-            return jsonify({'success': True, 'data': []})
-        results = prompt_model.search(keywords, project_ids)
+            return page_response([], None, limit)
     
-    return jsonify({'success': True, 'data': results})
+    try:
+        results, next_cursor = prompt_model.search_page(keywords, project_ids, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return page_response(results, next_cursor, limit)
+
+
+@app.route('/api/changes', methods=['GET'])
+@login_required
+def get_changes():
+    """
+    增量同步：返回 since 游标之后的变更记录（项目、提示词、版本、发布标签、标签的增删改）和新的 next_cursor，
+    客户端保存 next_cursor 作为下次轮询的 since；可用 project_id 只看单个项目。
+    """
+    project_id = request.args.get('project_id', type=int)
+    if project_id is not None and not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # 未指定项目时普通用户只能看到有权限的项目的变更
+    user_id = None if project_id is not None or is_admin() else get_current_user_id()
+    try:
+        changes, next_cursor = change_model.get_since(request.args.get('since') or None, limit,
+                                                      project_id, user_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'data': changes, 'next_cursor': next_cursor})
+
+
+@app.route('/api/stream', methods=['GET'])
+@login_required
+def stream_changes():
+    """
+    Server-Sent Events 推送变更，事件格式与 /api/changes 相同，事件 id 即变更游标。
+    断线重连时浏览器会带上 Last-Event-ID，先补发断点之后的变更再继续实时推送。
+    """
+    project_id = request.args.get('project_id', type=int)
+    if project_id is not None and not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    # 与 /api/changes 相同，非管理员按每条变更的当前权限过滤，连接期间新授权的项目和项目删除都能收到
+    user_id = None if is_admin() else get_current_user_id()
+    
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    since_id = 0
+    if cursor:
+        try:
+            since_id = decode_cursor(cursor, 1)[0]
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if not isinstance(since_id, int):
+            return jsonify({'success': False, 'error': '无效的分页游标'}), 400
+    
+    # 先订阅再读取断点之后的变更，两者重叠的部分在推送时去重，不会遗漏
+    subscriber = change_broadcaster.subscribe(project_id, user_id)
+    if subscriber is None:
+        # 本进程的连接数已达上限，让客户端稍后重试（可能落到其他 worker）
+        response = jsonify({'success': False, 'error': '实时推送连接数已满，请稍后重试'})
+        response.headers['Retry-After'] = str(RETRY_MS // 1000)
+        return response, 503
+    backlog = []
+    backlog_complete = True
+    while cursor:
+        changes, cursor = change_model.get_since(cursor, MAX_PAGE_SIZE, project_id, user_id)
+        backlog.extend(changes)
+        if len(changes) < MAX_PAGE_SIZE:
+            break
+        if len(backlog) >= SUBSCRIBER_QUEUE_SIZE:
+            # 积压太多时只补发一部分，客户端收完后重连继续
+            backlog_complete = False
+            break
+    
+    response = app.response_class(
+        stream_events(change_broadcaster, subscriber, backlog, backlog_complete, encode_cursor, since_id),
+        mimetype='text/event-stream',
+    )
+    # 客户端在响应开始前断开时生成器不会执行，由 close 回调退订
+    response.call_on_close(lambda: change_broadcaster.unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    # 关闭 Nginx 等反向代理的响应缓冲，事件才能立即送达
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/api/projects', methods=['GET'])
@@ -274,7 +566,7 @@ def get_projects():
     if is_admin():
         projects = project_model.get_all()
     else:
-        projects = project_permission_model.get_user_projects(session['user_id'])
+        projects = project_permission_model.get_user_projects(get_current_user_id())
     return jsonify({'success': True, 'data': projects})
 
 
@@ -295,7 +587,7 @@ def create_project():
         
         project_permission_model.grant_permission(project_id, user_id=user_id)
         
-        admin_group = group_model.get_by_name('管理员组')
+        admin_group = group_model.get_by_name(ADMIN_GROUP_NAME)
         if admin_group:
             project_permission_model.grant_permission(project_id, group_id=admin_group['id'])
         
@@ -307,15 +599,16 @@ def create_project():
 @app.route('/api/projects/<int:project_id>', methods=['GET'])
 @login_required
 def get_project(project_id):
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, project_id):
-            return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
     
+    etag = project_etag(project_id)
+    if is_fresh(etag):
+        return not_modified(etag)
     project = project_model.get_by_id(project_id)
     if not project:
         return jsonify({'success': False, 'error': '项目不存在'}), 404
-    return jsonify({'success': True, 'data': project})
+    return revalidate_response(jsonify({'success': True, 'data': project}), etag)
 
 
 @app.route('/api/projects/<int:project_id>', methods=['PUT'])
@@ -344,22 +637,84 @@ def delete_project(project_id):
     return jsonify({'success': True})
 
 
+@app.route('/api/projects/<int:project_id>/snapshot', methods=['GET'])
+@login_required
+def get_project_snapshot(project_id):
+    """项目下所有提示词在 as_of 时刻生效的内容"""
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    
+    if not project_model.get_by_id(project_id):
+        return jsonify({'success': False, 'error': '项目不存在'}), 404
+    
+    try:
+        as_of = get_as_of_arg()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    prompts = prompt_version_model.snapshot(as_of, project_id=project_id)
+    return jsonify({'success': True, 'data': {'as_of': as_of, 'prompts': prompts}})
+
+
+@app.route('/api/projects/<int:project_id>/bundle', methods=['GET'])
+@login_required
+def get_project_bundle(project_id):
+    """
+    项目的全部提示词（含标签，以及 labels=production,canary 指定的发布标签版本）打包为一个
+    gzip 压缩的 JSON。压缩结果和 ETag 按项目代数缓存，未变化时客户端用 If-None-Match 得到 304。
+    """
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    
+    labels = tuple(sorted({label.strip() for label in request.args.get('labels', '').split(',') if label.strip()}))
+    key = (project_id, labels)
+    # 先取代数再生成：生成期间发生的写入会让这份缓存在下次请求时失效
+    generation = db.get_generation(project_scope(project_id))
+    cached = bundle_cache.get(key)
+    if cached is None or cached[0] != generation:
+        bundle = project_model.get_bundle(project_id, labels)
+        if bundle is None:
+            return jsonify({'success': False, 'error': '项目不存在'}), 404
+        payload = json.dumps({'success': True, 'data': bundle}, ensure_ascii=False,
+                             separators=(',', ':')).encode('utf-8')
+        cached = (generation, hashlib.sha256(payload).hexdigest()[:32], gzip.compress(payload, mtime=0))
+        bundle_cache.set(key, cached)
+    
+    _, etag, data = cached
+    if is_fresh(etag):
+        return not_modified(etag)
+    if 'gzip' in request.accept_encodings:
+        response = app.response_class(data, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(gzip.decompress(data), mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return revalidate_response(response, etag)
+
+
 @app.route('/api/prompts', methods=['GET'])
 @login_required
 def get_prompts():
     project_id = request.args.get('project_id', type=int)
     
+    etag = None
     if project_id:
-        if not is_admin():
-            user_id = get_current_user_id()
-            if not project_permission_model.check_user_project_permission(user_id, project_id):
-                return jsonify({'success': False, 'error': '没有权限访问此项目的提示词'}), 403
-    
-    prompts = prompt_model.get_all(project_id)
-    # 为每个提示词附加标签
-    for p in prompts:
-        p['tags'] = tag_model.get_prompt_tags(p['id'])
-    return jsonify({'success': True, 'data': prompts})
+        if not can_read_project(project_id):
+            return jsonify({'success': False, 'error': '没有权限访问此项目的提示词'}), 403
+        etag = project_etag(project_id)
+        if is_fresh(etag):
+            return not_modified(etag)
+    
+    limit, cursor = get_page_args()
+    fields, with_tags = get_fields_arg()
+    try:
+        prompts, next_cursor = prompt_model.get_page(project_id, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if with_tags:
+        attach_tags(prompts)
+    response = page_response(prompts, next_cursor, limit)
+    return revalidate_response(response, etag) if etag else response
 
 
 @app.route('/api/prompts', methods=['POST'])
@@ -386,19 +741,57 @@ def create_prompt():
 @app.route('/api/prompts/<int:prompt_id>', methods=['GET'])
 @login_required
 def get_prompt(prompt_id):
+    project_id = prompt_model.get_project_id(prompt_id)
+    if project_id is None:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词'}), 403
+    
+    can_edit = can_write_project(project_id)
+    etag = project_etag(project_id, can_edit)
+    if is_fresh(etag):
+        return not_modified(etag)
+    
     prompt = prompt_model.get_by_id(prompt_id)
     if not prompt:
         return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    # 附加 can_edit 字段
+    prompt['can_edit'] = can_edit
     
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, prompt['project_id']):
-            return jsonify({'success': False, 'error': '没有权限访问此提示词'}), 403
+    return revalidate_response(jsonify({'success': True, 'data': prompt}), etag)
+
+
+@app.route('/api/prompts/<int:prompt_id>/view', methods=['GET'])
+@login_required
+def get_prompt_view(prompt_id):
+    """
+    提示词详情页的聚合接口：一次请求返回提示词、can_edit、提示词标签、项目标签、版本摘要和当前用户，
+    只做一次身份和权限检查。版本内容通过 /api/versions/<id>/content 按需获取。
+    """
+    user = get_current_user()
+    if not user:
+        # 会话中的用户已被删除
+        return jsonify({'success': False, 'error': '未登录或API Key无效'}), 401
     
-    # 附加 can_edit 字段
-    prompt['can_edit'] = can_write_project(prompt['project_id'])
+    project_id = prompt_model.get_project_id(prompt_id)
+    if project_id is None:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词'}), 403
     
-    return jsonify({'success': True, 'data': prompt})
+    can_edit = can_write_project(project_id)
+    etag = project_etag(project_id, can_edit)
+    if is_fresh(etag):
+        return not_modified(etag)
+    
+    view = prompt_model.get_view(prompt_id)
+    if not view:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    view['prompt']['can_edit'] = can_edit
+    view['user'] = {'id': user['id'], 'username': user['username'], 'is_admin': user['is_admin']}
+    return revalidate_response(jsonify({'success': True, 'data': view}), etag)
 
 
 @app.route('/api/prompts/<int:prompt_id>', methods=['PUT'])
@@ -416,17 +809,8 @@ def update_prompt(prompt_id):
         if not can_write_project(prompt['project_id']):
             return jsonify({'success': False, 'error': '没有权限修改此提示词'}), 403
         
-        current_version_number = prompt_version_model.get_current_version_number(prompt_id)
-        new_version_number = current_version_number + 1
-        
-        prompt_version_model.create(
-            prompt_id, 
-            new_version_number, 
-            prompt['title'], 
-            prompt['content']
-        )
-        
-        prompt_model.update(prompt_id, title, content)
+        if prompt_model.update_with_version(prompt_id, title, content) is None:
+            return jsonify({'success': False, 'error': '提示词不存在'}), 404
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -449,17 +833,95 @@ def delete_prompt(prompt_id):
 @app.route('/api/prompts/<int:prompt_id>/versions', methods=['GET'])
 @login_required
 def get_prompt_versions(prompt_id):
+    project_id = prompt_model.get_project_id(prompt_id)
+    if project_id is None:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词的版本'}), 403
+    
+    etag = project_etag(project_id)
+    if is_fresh(etag):
+        return not_modified(etag)
+    limit, cursor = get_page_args()
+    fields, _ = get_fields_arg()
+    try:
+        versions, next_cursor = prompt_version_model.get_page(prompt_id, limit, cursor, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return revalidate_response(page_response(versions, next_cursor, limit), etag)
+
+
+@app.route('/api/resolve/<project_name>/<path:ref>', methods=['GET'])
+@login_required
+def resolve_prompt(project_name, ref):
+    """
+    按 项目名/标题[@发布标签|@版本名称|@vN] 获取提示词内容，直接返回纯文本（供推理服务在运行时高频调用）。
+    标题本身包含 @ 且找不到对应版本时，按完整标题查找。
+    """
+    title, label = ref, None
+    if '@' in ref:
+        title, label = ref.rsplit('@', 1)
+    resolved = prompt_model.resolve(project_name, title, label)
+    if resolved is None and label is not None:
+        resolved = prompt_model.resolve(project_name, ref)
+    if resolved is None:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+
+    project_id, content = resolved
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词'}), 403
+
+    return app.response_class(content, mimetype='text/plain')
+
+
+@app.route('/api/prompts/<int:prompt_id>/snapshot', methods=['GET'])
+@login_required
+def get_prompt_snapshot(prompt_id):
+    """提示词在 as_of 时刻生效的内容"""
     prompt = prompt_model.get_by_id(prompt_id)
     if not prompt:
         return jsonify({'success': False, 'error': '提示词不存在'}), 404
     
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, prompt['project_id']):
-            return jsonify({'success': False, 'error': '没有权限访问此提示词的版本'}), 403
+    if not can_read_project(prompt['project_id']):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词的版本'}), 403
     
-    versions = prompt_version_model.get_all(prompt_id)
-    return jsonify({'success': True, 'data': versions})
+    try:
+        as_of = get_as_of_arg()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    snapshot = prompt_version_model.snapshot(as_of, prompt_id=prompt_id)
+    if not snapshot:
+        return jsonify({'success': False, 'error': '该时间点提示词尚未创建'}), 404
+    return jsonify({'success': True, 'data': {'as_of': as_of, **snapshot[0]}})
+
+
+@app.route('/api/prompts/<int:prompt_id>/diff', methods=['GET'])
+@login_required
+def diff_prompt_versions(prompt_id):
+    """比较两个版本：from / to 为版本 id，或 live 表示当前内容（to 默认为 live）"""
+    prompt = prompt_model.get_by_id(prompt_id)
+    if not prompt:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+
+    if not can_read_project(prompt['project_id']):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词的版本'}), 403
+
+    version_ids = []
+    for name, default in (('from', None), ('to', 'live')):
+        value = request.args.get(name, default)
+        if value == 'live':
+            version_ids.append(None)
+        elif value and value.isdigit():
+            version_ids.append(int(value))
+        else:
+            return jsonify({'success': False, 'error': f'{name} 必须是版本 id 或 live'}), 400
+
+    diff = prompt_version_model.diff(prompt_id, *version_ids)
+    if diff is None:
+        return jsonify({'success': False, 'error': '版本不存在'}), 404
+    return jsonify({'success': True, 'data': diff})
 
 
 @app.route('/api/versions/<int:version_id>', methods=['GET'])
@@ -469,14 +931,107 @@ def get_version(version_id):
     if not version:
         return jsonify({'success': False, 'error': '版本不存在'}), 404
     
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, version['project_id']):
-            return jsonify({'success': False, 'error': '没有权限访问此版本'}), 403
+    if not can_read_project(version['project_id']):
+        return jsonify({'success': False, 'error': '没有权限访问此版本'}), 403
     
     return jsonify({'success': True, 'data': version})
 
 
+@app.route('/api/versions/<int:version_id>/content', methods=['GET'])
+@login_required
+def get_version_content(version_id):
+    """版本内容（纯文本），不可变，带长期缓存响应头"""
+    version = prompt_version_model.get_by_id(version_id)
+    if not version:
+        return jsonify({'success': False, 'error': '版本不存在'}), 404
+    
+    if not can_read_project(version['project_id']):
+        return jsonify({'success': False, 'error': '没有权限访问此版本'}), 403
+    
+    return immutable_response(app.response_class(version['content'], mimetype='text/plain'))
+
+
+@app.route('/api/prompts/<int:prompt_id>/labels', methods=['GET'])
+@login_required
+def get_prompt_labels(prompt_id):
+    project_id = prompt_model.get_project_id(prompt_id)
+    if project_id is None:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词的版本'}), 403
+    
+    etag = project_etag(project_id)
+    if is_fresh(etag):
+        return not_modified(etag)
+    return revalidate_response(jsonify({'success': True, 'data': prompt_label_model.get_all(prompt_id)}), etag)
+
+
+@app.route('/api/prompts/<int:prompt_id>/labels/<label>', methods=['GET'])
+@login_required
+def get_version_by_label(prompt_id, label):
+    """
+    获取标签当前指向的版本。标签可以移动，响应不缓存；
+    Content-Location 给出该版本不可变的内容地址。
+    """
+    prompt = prompt_model.get_by_id(prompt_id)
+    if not prompt:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_read_project(prompt['project_id']):
+        return jsonify({'success': False, 'error': '没有权限访问此提示词的版本'}), 403
+    
+    version_id = prompt_label_model.get_version_id(prompt_id, label)
+    version = prompt_version_model.get_by_id(version_id) if version_id else None
+    if not version:
+        return jsonify({'success': False, 'error': '标签不存在'}), 404
+    
+    response = jsonify({'success': True, 'data': {'label': label, **version}})
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Content-Location'] = url_for('get_version_content', version_id=version_id)
+    return response
+
+
+@app.route('/api/prompts/<int:prompt_id>/labels/<label>', methods=['PUT'])
+@login_required
+def set_prompt_label(prompt_id, label):
+    """把标签指向指定版本：{"version_id": 12}"""
+    data = request.get_json()
+    version_id = data.get('version_id') if data else None
+    
+    if not isinstance(version_id, int):
+        return jsonify({'success': False, 'error': 'version_id 不能为空'}), 400
+    
+    prompt = prompt_model.get_by_id(prompt_id)
+    if not prompt:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_write_project(prompt['project_id']):
+        return jsonify({'success': False, 'error': '没有权限修改此提示词'}), 403
+    
+    try:
+        if not prompt_label_model.set(prompt_id, label, version_id):
+            return jsonify({'success': False, 'error': '版本不存在'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True})
+
+
+@app.route('/api/prompts/<int:prompt_id>/labels/<label>', methods=['DELETE'])
+@login_required
+def delete_prompt_label(prompt_id, label):
+    prompt = prompt_model.get_by_id(prompt_id)
+    if not prompt:
+        return jsonify({'success': False, 'error': '提示词不存在'}), 404
+    
+    if not can_write_project(prompt['project_id']):
+        return jsonify({'success': False, 'error': '没有权限修改此提示词'}), 403
+    
+    if not prompt_label_model.delete(prompt_id, label):
+        return jsonify({'success': False, 'error': '标签不存在'}), 404
+    return jsonify({'success': True})
+
+
 @app.route('/api/versions/<int:version_id>/rename', methods=['PUT'])
 @login_required
 def rename_version(version_id):
@@ -500,6 +1055,17 @@ def rename_version(version_id):
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+@admin_required
+def get_cache_stats():
+    """本 worker 进程中查询缓存和数据包缓存的条目数、估算大小和命中率"""
+    return jsonify({'success': True, 'data': {
+        'query': db.query_cache.stats(),
+        'bundle': bundle_cache.stats(),
+    }})
+
+
 @app.route('/api/users', methods=['GET'])
 @login_required
 @admin_required
@@ -583,7 +1149,7 @@ def update_group(group_id):
 @admin_required
 def delete_group(group_id):
     group = group_model.get_by_id(group_id)
-    if group and group['name'] == '管理员组':
+    if group and group['name'] == ADMIN_GROUP_NAME:
         return jsonify({'success': False, 'error': '不能删除管理员组'}), 400
     group_model.delete(group_id)
     return jsonify({'success': True})
@@ -719,12 +1285,13 @@ def can_edit_project(project_id):
 @app.route('/api/projects/<int:project_id>/tags', methods=['GET'])
 @login_required
 def get_project_tags(project_id):
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, project_id):
-            return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限访问此项目'}), 403
+    etag = project_etag(project_id)
+    if is_fresh(etag):
+        return not_modified(etag)
     tags = tag_model.get_project_tags(project_id)
-    return jsonify({'success': True, 'data': tags})
+    return revalidate_response(jsonify({'success': True, 'data': tags}), etag)
 
 
 @app.route('/api/projects/<int:project_id>/tags', methods=['POST'])
@@ -749,17 +1316,18 @@ def create_tag(project_id):
 @app.route('/api/prompts/<int:prompt_id>/tags', methods=['GET'])
 @login_required
 def get_prompt_tags(prompt_id):
-    prompt = prompt_model.get_by_id(prompt_id)
-    if not prompt:
+    project_id = prompt_model.get_project_id(prompt_id)
+    if project_id is None:
         return jsonify({'success': False, 'error': '提示词不存在'}), 404
     
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, prompt['project_id']):
-            return jsonify({'success': False, 'error': '没有权限'}), 403
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限'}), 403
     
+    etag = project_etag(project_id)
+    if is_fresh(etag):
+        return not_modified(etag)
     tags = tag_model.get_prompt_tags(prompt_id)
-    return jsonify({'success': True, 'data': tags})
+    return revalidate_response(jsonify({'success': True, 'data': tags}), etag)
 
 
 @app.route('/api/prompts/<int:prompt_id>/tags', methods=['POST'])
@@ -806,10 +1374,8 @@ def remove_tag_from_prompt(prompt_id, tag_id):
 @app.route('/api/projects/<int:project_id>/prompts-by-tags', methods=['GET'])
 @login_required
 def get_prompts_by_tags(project_id):
-    if not is_admin():
-        user_id = get_current_user_id()
-        if not project_permission_model.check_user_project_permission(user_id, project_id):
-            return jsonify({'success': False, 'error': '没有权限'}), 403
+    if not can_read_project(project_id):
+        return jsonify({'success': False, 'error': '没有权限'}), 403
     
     tag_ids = request.args.get('tag_ids', '')
     if not tag_ids:
@@ -820,10 +1386,17 @@ def get_prompts_by_tags(project_id):
     except ValueError:
         return jsonify({'success': False, 'error': '标签ID格式错误'}), 400
     
-    prompts = tag_model.get_prompts_by_tags(project_id, tag_id_list)
-    for p in prompts:
-        p['tags'] = tag_model.get_prompt_tags(p['id'])
-    return jsonify({'success': True, 'data': prompts})
+    etag = project_etag(project_id)
+    if is_fresh(etag):
+        return not_modified(etag)
+    fields, with_tags = get_fields_arg()
+    try:
+        prompts = tag_model.get_prompts_by_tags(project_id, tag_id_list, fields)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if with_tags:
+        attach_tags(prompts)
+    return revalidate_response(jsonify({'success': True, 'data': prompts}), etag)
 
 
 if __name__ == '__main__':
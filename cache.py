@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存：最多保存 maxsize 个条目，设置 ttl 后条目过期自动失效。
+    设置 maxweight 后，条目的 weight 之和（如估算的字节数）也不超过该值。
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, maxweight: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING:
+                self.misses += 1
+                return default
+            value, expires_at, weight = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.weight -= weight
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, weight: int = 0):
+        if self.maxweight is not None and weight > self.maxweight:
+            # 单个条目超过总容量，不缓存
+            self.pop(key)
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= old[2]
+            self._data[key] = (value, expires_at, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                _, evicted = self._data.popitem(last=False)
+                self.weight -= evicted[2]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, self._MISSING)
+            if item is not self._MISSING:
+                self.weight -= item[2]
+        return default if item is self._MISSING else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'weight': self.weight,
+                'maxweight': self.maxweight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+def _clone(value: Any) -> Any:
+    """复制查询结果中的字典和列表，调用方修改返回值不会影响缓存"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_clone(v) for v in value)
+    return value
+
+
+def _sizeof(value: Any) -> int:
+    """粗略估算查询结果占用的字节数，用于限制缓存总大小"""
+    if isinstance(value, dict):
+        return 64 + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(_sizeof(v) for v in value)
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, bytes):
+        return 33 + len(value)
+    return 28
+
+
+class QueryCache:
+    """
+    读穿查询缓存：结果与读取前的作用域代数一起保存，代数变化（包括其他 worker 进程的写入）后自动失效。
+    get_generation(scope) 返回作用域的当前代数（即 Database.get_generation）。
+    backend 只需提供与 LRUCache 相同的 get / set(key, value, weight) / clear / stats 方法，
+    默认使用按条目数和估算字节数限制大小的 LRUCache。
+    """
+
+    def __init__(self, get_generation: Callable[[str], int], backend=None,
+                 maxsize: int = 4096, maxweight: int = 64 * 1024 * 1024):
+        self.get_generation = get_generation
+        self.backend = backend if backend is not None else LRUCache(maxsize, maxweight=maxweight)
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, scope: Optional[str], key: Hashable, loader: Callable[[], Any]) -> Any:
+        """scope 为 None 时不缓存，直接调用 loader"""
+        if scope is None:
+            with self._lock:
+                self.bypasses += 1
+            return loader()
+        # 先取代数再读数据：读取期间发生的写入会使这次缓存的结果在下次访问时失效
+        generation = self.get_generation(scope)
+        cached = self.backend.get(key)
+        hit = cached is not None and cached[0] == scope and cached[1] == generation
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            return _clone(cached[2])
+        value = loader()
+        self.backend.set(key, (scope, generation, _clone(value)), _sizeof(value))
+        return value
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        """命中数和未命中数按代数判断（后端中存在但已失效的条目算作未命中）"""
+        result = self.backend.stats()
+        with self._lock:
+            total = self.hits + self.misses
+            result.update(hits=self.hits, misses=self.misses, bypasses=self.bypasses,
+                          hit_rate=self.hits / total if total else 0.0)
+        return result
@@ -0,0 +1,202 @@
+import json
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+# 每个订阅者最多积压的事件数，超出说明客户端消费太慢，断开后由客户端带 Last-Event-ID 重连补齐
+SUBSCRIBER_QUEUE_SIZE = 1000
+# 没有事件时发送心跳注释的间隔（秒），防止代理因空闲断开连接
+HEARTBEAT_INTERVAL = 15.0
+# 轮询变更日志的间隔（秒）：本进程的写入提交后立即唤醒，其他 worker 进程的写入最多延迟这么久
+POLL_INTERVAL = 1.0
+# 客户端断线后的重连等待时间（毫秒）
+RETRY_MS = 3000
+# 每个进程同时保持的 SSE 连接数上限，超出时拒绝新的订阅。gunicorn.conf.py 使用 gevent worker，
+# 按 worker_connections 设置；直接运行 app.py 的开发服务器每个连接占用一个线程，默认值较小
+MAX_SUBSCRIBERS = 100
+
+
+class Subscriber:
+    """
+    一个 SSE 连接：有界的事件队列。project_id 为 None 时接收所有项目的事件；
+    user_id 为 None（管理员）时不按权限过滤，否则只接收该用户可读的变更。
+    """
+
+    def __init__(self, project_id: Optional[int] = None, user_id: Optional[int] = None,
+                 maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.project_id = project_id
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._queue: deque = deque()
+        self._ready = threading.Event()
+
+    def accepts(self, change: Dict[str, Any], readers: Optional[Set[int]] = None) -> bool:
+        """readers 为可读这条变更的用户 id 集合（ChangeModel.get_readers）"""
+        if self.project_id is not None and change['project_id'] != self.project_id:
+            return False
+        return self.user_id is None or (readers is not None and self.user_id in readers)
+
+    def put(self, event: tuple):
+        if len(self._queue) >= self.maxsize:
+            self.overflowed = True
+        else:
+            self._queue.append(event)
+        self._ready.set()
+
+    def get_all(self, timeout: float) -> List[tuple]:
+        """等待至多 timeout 秒，取出队列中的全部事件"""
+        if not self._queue:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        events = []
+        while self._queue:
+            events.append(self._queue.popleft())
+        return events
+
+
+class ChangeBroadcaster:
+    """
+    进程内唯一的变更广播器：一个后台线程按 id 顺序读取变更日志，分发到各订阅者的有界队列。
+    订阅者只占用一个队列，不需要各自轮询数据库。按权限过滤时每批变更的可读用户只查询一次，
+    与订阅者数量无关，授权、撤销和项目删除对已建立的连接立即生效。changes 需提供
+    get_since(cursor, limit)、get_readers(changes) 和 latest_cursor()（即 ChangeModel），
+    on_idle 在每次读取后调用，用于归还数据库连接。
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, changes, on_idle: Callable = None, poll_interval: float = POLL_INTERVAL,
+                 max_subscribers: int = MAX_SUBSCRIBERS):
+        self.changes = changes
+        self.on_idle = on_idle
+        self.poll_interval = poll_interval
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = threading.Event()
+        self._cursor = None
+        self._thread = None
+
+    def subscribe(self, project_id: Optional[int] = None, user_id: Optional[int] = None) -> Optional[Subscriber]:
+        """
+        注册订阅者，订阅者已达上限时返回 None。返回时广播器已确定起始位置：
+        此后提交的变更都会进入队列，之前的变更由调用方按 Last-Event-ID 从变更日志补齐。
+        """
+        subscriber = Subscriber(project_id, user_id)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                # 首个订阅者出现时才启动后台线程
+                self._thread = threading.Thread(target=self._run, name='change-broadcaster', daemon=True)
+                self._thread.start()
+        self._started.wait()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def notify(self):
+        """本进程有写入提交，立即读取新的变更"""
+        self._wakeup.set()
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _fetch(self, cursor: Optional[str]):
+        """读取下一批变更，有按权限过滤的订阅者时一并读取各变更的可读用户"""
+        with self._lock:
+            by_user = any(s.user_id is not None for s in self._subscribers)
+        try:
+            changes, cursor = self.changes.get_since(cursor, self.BATCH_SIZE)
+            readers = self.changes.get_readers(changes) if changes and by_user else {}
+            return changes, cursor, readers
+        finally:
+            if self.on_idle:
+                self.on_idle()
+
+    def _latest(self) -> Optional[str]:
+        try:
+            return self.changes.latest_cursor()
+        except Exception:
+            return None
+        finally:
+            if self.on_idle:
+                self.on_idle()
+
+    def _run(self):
+        self._cursor = self._latest()
+        self._started.set()
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            if self._cursor is None:
+                self._cursor = self._latest()
+                continue
+            try:
+                changes, cursor, readers = self._fetch(self._cursor)
+            except Exception:
+                continue
+            while changes:
+                self._publish(changes, readers)
+                self._cursor = cursor
+                if len(changes) < self.BATCH_SIZE:
+                    break
+                try:
+                    changes, cursor, readers = self._fetch(self._cursor)
+                except Exception:
+                    break
+
+    def _publish(self, changes: List[Dict[str, Any]], readers: Dict[int, Set[int]]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for change in changes:
+            event = (change['id'], change)
+            change_readers = readers.get(change['id'])
+            for subscriber in subscribers:
+                if subscriber.accepts(change, change_readers):
+                    subscriber.put(event)
+
+
+def format_event(event_id: str, event: str, data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'
+
+
+def stream_events(broadcaster: ChangeBroadcaster, subscriber: Subscriber, backlog: List[Dict[str, Any]],
+                  backlog_complete: bool, encode_id: Callable, since_id: int = 0,
+                  heartbeat_interval: float = HEARTBEAT_INTERVAL) -> Iterator[str]:
+    """
+    生成 SSE 响应正文：先发送重连补齐的历史变更，再发送订阅后到达的实时变更。
+    订阅先于读取历史，两者可能重叠，按变更 id 去重。since_id 为 Last-Event-ID 对应的变更 id，
+    没有历史可补时队列中不晚于它的变更客户端也已收到过。历史未补齐或队列溢出时结束响应，
+    客户端带 Last-Event-ID 重连后从断点继续。
+    """
+    last_id = max(since_id, backlog[-1]['id'] if backlog else 0)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for change in backlog:
+            yield format_event(encode_id(change['id']), 'change', change)
+        if not backlog_complete:
+            return
+        while True:
+            events = subscriber.get_all(heartbeat_interval)
+            if subscriber.overflowed:
+                return
+            if not events:
+                yield ': heartbeat\n\n'
+                continue
+            for change_id, change in events:
+                if change_id <= last_id:
+                    continue
+                last_id = change_id
+                yield format_event(encode_id(change_id), 'change', change)
+    finally:
+        broadcaster.unsubscribe(subscriber)
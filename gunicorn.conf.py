@@ -0,0 +1,28 @@
+"""
+多进程部署配置，用法: gunicorn -c gunicorn.conf.py app:app
+
+所有 worker 共享同一个 SQLite 数据库文件，PROMPTBOX_ENV=production 会启用
+WAL 日志模式：读请求可以在多个进程中并行执行，不会被写操作阻塞；写操作之间
+通过 busy timeout 排队等待，而不是直接报 "database is locked"。
+
+worker 使用 gevent：每个请求是一个协程，/api/stream 的订阅者空闲时只占用一个
+协程和一个有界队列，单个 worker 可以同时保持数千个 SSE 连接。SQLite 调用本身是
+同步的，但都是毫秒级的索引查询；等待写锁时不使用 SQLite 的 busy handler，
+而是在 Python 中退避重试（见 Database.transaction），不会卡住事件循环。
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('PROMPTBOX_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('PROMPTBOX_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gevent'
+# 每个 worker 同时处理的连接数（包括 SSE 连接）
+worker_connections = int(os.environ.get('PROMPTBOX_WORKER_CONNECTIONS', 10000))
+# 订阅者最多占用九成连接，其余留给普通请求，超出时 /api/stream 返回 503
+max_streams = int(os.environ.get('PROMPTBOX_MAX_STREAMS', worker_connections * 9 // 10))
+
+# 每个 worker 必须自己创建数据库连接池，SQLite 连接不能跨 fork 共享
+preload_app = False
+
+raw_env = ['PROMPTBOX_ENV=production', f'PROMPTBOX_MAX_STREAMS={max_streams}']
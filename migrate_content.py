@@ -0,0 +1,41 @@
+"""
+重新编码数据库中已有的内容：较大的提示词内容改存到按哈希去重的 content_blobs，
+历史版本改为“关键帧 + 增量”存储，正文按指定算法压缩，最后回收磁盘空间。
+分批执行，可在服务运行期间执行，也可重复运行；运行前建议备份 prompts.db。
+
+用法: python migrate_content.py [数据库路径] [zlib|lzma|none]
+"""
+
+import sys
+
+from models import Database, PromptModel, PromptVersionModel
+
+DB_PATH = sys.argv[1] if len(sys.argv) > 1 else 'prompts.db'
+CODEC = sys.argv[2] if len(sys.argv) > 2 else 'zlib'
+
+
+def migrate():
+    db = Database(DB_PATH)
+    codec = None if CODEC == 'none' else CODEC
+
+    total = PromptModel(db).reencode(codec)
+    print(f"  提示词: {total} 行已重新编码")
+
+    version_model = PromptVersionModel(db)
+    prompts = db.fetch_all('SELECT DISTINCT prompt_id FROM prompt_versions')
+    total = 0
+    for prompt in prompts:
+        total += version_model.compact(prompt['prompt_id'], codec)
+    print(f"  历史版本: {len(prompts)} 个提示词，{total} 个版本已重新编码")
+
+    total = db.reencode_blobs(codec)
+    print(f"  正文: {total} 条已重新压缩，{db.collect_blobs()} 条无引用的正文已删除")
+
+    db.get_connection().execute('VACUUM')
+    db.close()
+    print("迁移完成！")
+
+
+if __name__ == '__main__':
+    print(f"正在重新编码 {DB_PATH} 中的内容 (codec: {CODEC})...\n")
+    migrate()
@@ -1,7 +1,20 @@
 import sqlite3
+import threading
+import time
+import base64
+import json
+from contextlib import contextmanager
+from functools import wraps
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Set, Tuple
 import hashlib
+import difflib
+import re
+import zlib
+import lzma
+
+from cache import LRUCache, QueryCache
+from textdiff import diff_text
 
 BEIJING_TZ = timezone(timedelta(hours=8))
 
@@ -11,16 +24,508 @@ def now_beijing() -> str:
     return datetime.now(BEIJING_TZ).strftime('%Y-%m-%d %H:%M:%S')
 
 
+def to_beijing_timestamp(value: str) -> str:
+    """
+    把 ISO 8601 时间（如 2024-05-01T12:00:00+00:00、2024-05-01 20:00:00、2024-05-01）
+    转为数据库中的北京时间字符串；不带时区的时间按北京时间处理。格式错误时抛出 ValueError。
+    """
+    value = value.strip()
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(BEIJING_TZ)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# 项目列表的缓存作用域：项目创建、修改、删除时递增代数
+PROJECTS_SCOPE = 'projects'
+
+
+def project_scope(project_id: int) -> str:
+    """项目的缓存作用域：项目及其提示词、版本有任何变化时递增代数"""
+    return f'project:{project_id}'
+
+
+def cached_query(scope: Callable[..., Optional[str]]):
+    """
+    模型读方法的读穿缓存（Database.query_cache）。scope 以与方法相同的参数调用，返回结果所依赖的
+    缓存作用域，该作用域的代数递增后缓存失效；返回 None 或在事务中调用时直接查询数据库。
+    """
+    def decorator(method):
+        name = method.__qualname__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.db.in_transaction():
+                return method(self, *args, **kwargs)
+            key = repr((name, args, sorted(kwargs.items())))
+            return self.db.query_cache.get_or_load(
+                scope(self, *args, **kwargs), key, lambda: method(self, *args, **kwargs)
+            )
+        return wrapper
+    return decorator
+
+
+def encode_cursor(*values) -> str:
+    """将排序键编码为不透明的分页游标"""
+    raw = json.dumps(values, separators=(',', ':'), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, size: int) -> tuple:
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('无效的分页游标')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('无效的分页游标')
+    return tuple(values)
+
+
+# 大段内容的压缩编码：content_blobs.codec（及早期直接压缩的 content_codec 列）记录编码方式，
+# NULL 表示未压缩的文本
+CONTENT_CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+DEFAULT_CONTENT_CODEC = 'zlib'
+# 短于此字节数的内容不压缩
+COMPRESS_MIN_SIZE = 1024
+
+
+def encode_content(text: str, codec: str = DEFAULT_CONTENT_CODEC):
+    """
+    压缩较大的内容，返回 (编码后的数据, 编码方式)。
+    内容较短或压缩收益不足 10% 时原样返回 (text, None)。
+    """
+    raw = text.encode('utf-8')
+    if codec is None or len(raw) < COMPRESS_MIN_SIZE:
+        return text, None
+    data = CONTENT_CODECS[codec][0](raw)
+    if len(data) > len(raw) * 0.9:
+        return text, None
+    return data, codec
+
+
+def decode_content(value, codec: Optional[str]):
+    """
+    还原 content 列的值。注册为各连接上的 SQL 函数 decode_content(content, content_codec)，
+    只供本应用的查询和 LIKE 搜索使用，表结构（触发器、视图）不能依赖它；非压缩编码（如 'delta'）原样返回。
+    """
+    if codec in CONTENT_CODECS:
+        return CONTENT_CODECS[codec][1](value).decode('utf-8')
+    return value
+
+
+# 不短于此字节数的内容按哈希存入 content_blobs 去重，content 列保存哈希，content_codec 为 'blob'
+BLOB_MIN_SIZE = 128
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def content_expr(alias: str = '') -> str:
+    """读取 content 列时使用的表达式：从 content_blobs 取出或直接解压"""
+    return (f"CASE {alias}content_codec WHEN 'blob' THEN "
+            f"(SELECT decode_content(cb.data, cb.codec) FROM content_blobs cb WHERE cb.hash = {alias}content) "
+            f"ELSE decode_content({alias}content, {alias}content_codec) END")
+
+
+def make_delta(base: str, target: str) -> str:
+    """
+    生成把 base 变为 target 的行级增量（JSON）：[a, b] 表示复制 base 的第 a 到 b 行，
+    字符串表示插入的文本。按 keepends 切分行，还原结果与原文逐字节一致。
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops = []
+    # 在写事务中调用，使用耗时稳定的 difflib；Myers 算法（textdiff）在改动很大时明显更慢，只用于展示差异
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('replace', 'insert'):
+            text = ''.join(target_lines[j1:j2])
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += text
+            else:
+                ops.append(text)
+    return json.dumps(ops, separators=(',', ':'), ensure_ascii=False)
+
+
+def apply_delta(base: str, delta: str) -> str:
+    """将 make_delta 生成的增量应用到 base 上，还原出完整内容"""
+    base_lines = base.splitlines(keepends=True)
+    return ''.join(
+        op if isinstance(op, str) else ''.join(base_lines[op[0]:op[1]])
+        for op in json.loads(delta)
+    )
+
+
+PREVIEW_LENGTH = 200
+
+
+def select_fields(fields: Optional[List[str]], columns: Tuple[str, ...], required: Tuple[str, ...] = (),
+                  alias: str = '', extra: Dict[str, str] = None, content: str = None) -> str:
+    """
+    根据请求的字段生成 SELECT 列表，使不需要的列（尤其是 content）不必从数据库读出。
+    fields 为 None 时返回全部列；'preview' 表示 content 的前 PREVIEW_LENGTH 个字符；
+    required 中的列（id、排序键）总会返回；extra 为额外的 {字段名: SQL 表达式}；
+    content 为读取正文的 SQL 表达式，默认还原 content 列。
+    """
+    extra = extra or {}
+    content = content or content_expr(alias)
+    if fields is None:
+        return ', '.join([column_expr(c, alias, content) for c in columns] +
+                         [f'{expr} as {name}' for name, expr in extra.items()])
+    
+    unknown = [f for f in fields if f not in columns and f not in extra and f != 'preview']
+    if unknown:
+        raise ValueError(f'未知字段: {", ".join(unknown)}')
+    
+    exprs = [column_expr(c, alias, content) for c in columns if c in fields or c in required]
+    exprs += [f'{expr} as {name}' for name, expr in extra.items() if name in fields]
+    if 'preview' in fields:
+        exprs.append(f'substr({content}, 1, {PREVIEW_LENGTH}) as preview')
+    return ', '.join(exprs)
+
+
+def column_expr(column: str, alias: str = '', content: str = None) -> str:
+    """content 列可能被压缩，读取时解压（或使用 content 给出的表达式）；其他列原样读取"""
+    if column == 'content':
+        return f'{content or content_expr(alias)} as content'
+    return f'{alias}{column}'
+
+
+def paginate(rows: List[Dict[str, Any]], limit: Optional[int], sort_keys: Tuple[str, ...]):
+    """
+    rows 是按 LIMIT limit + 1 查出的结果，多出的一行说明还有下一页。
+    返回 (本页数据, next_cursor)，next_cursor 由本页最后一行的排序键生成。
+    """
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*(rows[-1][key] for key in sort_keys))
+
+
+class PooledConnection(sqlite3.Connection):
+    """连接池中的连接，额外记录该连接上次看到的 PRAGMA data_version"""
+    seen_data_version = None
+
+
+class ConnectionPool:
+    """有界的 SQLite 连接池：复用空闲连接，同时打开的连接数不超过 max_connections"""
+
+    def __init__(self, db_path: str, max_connections: int = 8, timeout: float = 30.0,
+                 busy_timeout: float = 5.0, pragmas: tuple = ()):
+        self.db_path = db_path
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.pragmas = pragmas
+        self._idle: List[sqlite3.Connection] = []
+        self._opened = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 连接会在线程间借还，但同一时刻只被一个线程持有
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False,
+                               factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.create_function('decode_content', 2, decode_content, deterministic=True)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    def acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise sqlite3.ProgrammingError('连接池已关闭')
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._opened < self.max_connections:
+                        self._opened += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise sqlite3.OperationalError('数据库连接池已耗尽')
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opened -= 1
+                        self._cond.notify()
+                    raise
+
+            # 复用前做健康检查，失效的连接直接丢弃后重试
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append(conn)
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
 class Database:
-    def __init__(self, db_path: str = 'prompts.db'):
+    # 生产模式下每个连接的调优参数（WAL 模式本身在 enable_wal 中持久化到数据库文件）
+    PRODUCTION_PRAGMAS = (
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA cache_size = -20000',
+        'PRAGMA mmap_size = 268435456',
+        'PRAGMA temp_store = MEMORY',
+    )
+
+    # 由 ensure_indexes 维护的二级索引，名称统一以 idx_ 开头，定义以 UNIQUE 开头的为唯一索引。
+    # 复合索引的列顺序与对应查询的 WHERE/ORDER BY 保持一致：
+    #   PromptModel.get_all                          -> idx_prompts_project_created
+    #   PromptVersionModel.get_current_version_number -> idx_prompt_versions_prompt_version
+    #   ProjectPermissionModel.check_user_project_permission 查 effective_permissions 主键，不需要二级索引
+    #   ProjectPermissionModel.get_project_permissions -> idx_project_permissions_project
+    #   Database.refresh_effective_permissions（effective_permissions_source 视图的连接）
+    #                                                -> idx_project_permissions_group, idx_user_groups_group
+    #   Database.refresh_effective_permissions 按项目清除 -> idx_effective_permissions_project
+    #   TagModel.get_prompts_by_tags                 -> idx_prompt_tags_tag, idx_prompts_project_created
+    #   PromptModel.resolve                          -> idx_prompts_project_title
+    #   PromptVersionModel.delete                    -> idx_prompt_labels_version
+    #   ChangeModel.get_since                        -> idx_changes_project
+    #   ChangeModel.get_readers                      -> idx_effective_permissions_project, idx_change_readers_change
+    #   PromptVersionModel.snapshot                  -> idx_prompt_versions_prompt_created, idx_prompts_project_created
+    INDEXES = {
+        'idx_projects_created': 'projects (created_at)',
+        'idx_prompts_project_created': 'prompts (project_id, created_at)',
+        'idx_prompts_created': 'prompts (created_at)',
+        'idx_prompts_updated': 'prompts (updated_at)',
+        'idx_prompts_project_title': 'prompts (project_id, title, created_at)',
+        'idx_prompt_versions_prompt_version': 'UNIQUE prompt_versions (prompt_id, version_number)',
+        'idx_prompt_tags_tag': 'prompt_tags (tag_id, prompt_id)',
+        'idx_project_permissions_project': 'project_permissions (project_id, user_id, group_id)',
+        'idx_project_permissions_user': 'project_permissions (user_id)',
+        'idx_project_permissions_group': 'project_permissions (group_id)',
+        'idx_user_groups_group': 'user_groups (group_id, user_id)',
+        'idx_tags_project': 'tags (project_id, active, name)',
+        'idx_api_keys_user': 'api_keys (user_id, created_at)',
+        'idx_prompt_versions_base': 'prompt_versions (base_version_id)',
+        'idx_prompt_labels_version': 'prompt_labels (version_id)',
+        'idx_prompt_versions_prompt_created': 'prompt_versions (prompt_id, created_at, version_number)',
+        'idx_effective_permissions_project': 'effective_permissions (project_id)',
+        'idx_changes_project': 'changes (project_id, id)',
+        'idx_change_readers_change': 'change_readers (change_id)',
+    }
+
+    def __init__(self, db_path: str = 'prompts.db', pool_size: int = 8, production: bool = False,
+                 busy_timeout: float = 5.0, checkpoint_interval: float = 300.0,
+                 query_cache_size: int = 4096, query_cache_bytes: int = 64 * 1024 * 1024,
+                 query_cache_backend=None):
+        """
+        production=True 时启用 WAL 日志、连接调优参数和定时 checkpoint，
+        适用于多个 worker 进程共享同一个数据库文件的部署方式。
+        查询缓存默认为进程内 LRU，最多 query_cache_size 个结果、估算约 query_cache_bytes 字节；
+        query_cache_backend 可替换为其他实现（接口同 LRUCache）。
+        """
         self.db_path = db_path
+        self.production = production
+        self.pool = ConnectionPool(
+            db_path, pool_size,
+            busy_timeout=busy_timeout,
+            pragmas=self.PRODUCTION_PRAGMAS if production else (),
+        )
+        self._local = threading.local()
+        self._generations: Dict[str, int] = {}
+        self._generations_epoch = 0
+        self._generations_lock = threading.Lock()
+        # 变更日志有新记录提交时调用的回调（如推送事件的广播器）
+        self.change_listeners: List[Callable[[], None]] = []
+        self.query_cache = QueryCache(self.get_generation, query_cache_backend,
+                                      query_cache_size, query_cache_bytes)
+        # prompt_id -> project_id。id 不会复用、提示词不会移动到其他项目，映射无需失效
+        self._prompt_projects = LRUCache(65536)
+        self.fts_enabled = False
+        self._stop_event = threading.Event()
+        self._checkpoint_thread = None
+        if production:
+            self.enable_wal()
         self.init_db()
-
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        self.release_connection()
+        if production and checkpoint_interval > 0:
+            self._checkpoint_thread = threading.Thread(
+                target=self._checkpoint_loop, args=(checkpoint_interval,),
+                name='sqlite-checkpoint', daemon=True,
+            )
+            self._checkpoint_thread.start()
+
+    def get_connection(self) -> sqlite3.Connection:
+        """返回当前线程持有的连接，首次调用时从连接池借出"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.pool.acquire()
+            self._local.conn = conn
         return conn
 
+    def release_connection(self):
+        """将当前线程持有的连接归还连接池（每个请求结束时调用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            self.pool.release(conn)
+
+    def close(self):
+        """关闭连接池中的所有连接（进程退出时调用）"""
+        self._stop_event.set()
+        if self.production:
+            try:
+                self.checkpoint('TRUNCATE')
+            except sqlite3.Error:
+                pass
+        self.release_connection()
+        self.pool.close_all()
+
+    def get_generation(self, scope: str) -> int:
+        """
+        返回缓存作用域的当前代数。其他连接（包括其他 worker 进程）提交过写入时，
+        当前连接的 PRAGMA data_version 会变化，此时丢弃本进程的代数副本并重新读取，
+        因此缓存失效在多进程间同样生效。
+        """
+        conn = self.get_connection()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        with self._generations_lock:
+            if conn.seen_data_version != data_version:
+                conn.seen_data_version = data_version
+                self._generations.clear()
+                self._generations_epoch += 1
+            generation = self._generations.get(scope)
+            epoch = self._generations_epoch
+        if generation is None:
+            row = conn.execute('SELECT generation FROM cache_generations WHERE scope = ?', (scope,)).fetchone()
+            generation = row['generation'] if row else 0
+            with self._generations_lock:
+                # 读取期间副本被清空过，说明读到的值可能已过期，不写回副本
+                if epoch == self._generations_epoch:
+                    self._generations[scope] = generation
+        return generation
+
+    def bump_generation(self, scope: str):
+        """使该作用域下的所有缓存失效（所有 worker 进程）"""
+        self.execute_query(
+            '''INSERT INTO cache_generations (scope, generation) VALUES (?, 1)
+               ON CONFLICT(scope) DO UPDATE SET generation = generation + 1''',
+            (scope,)
+        )
+        self.after_commit(lambda: self._forget_generation(scope))
+
+    def prompt_scope(self, prompt_id: int) -> Optional[str]:
+        """提示词所属项目的缓存作用域，提示词不存在时返回 None"""
+        project_id = self._prompt_projects.get(prompt_id)
+        if project_id is None:
+            row = self.fetch_one('SELECT project_id FROM prompts WHERE id = ?', (prompt_id,))
+            if not row:
+                return None
+            project_id = row['project_id']
+            self._prompt_projects.set(prompt_id, project_id)
+        return project_scope(project_id)
+
+    def touch_project(self, project_id: Optional[int]):
+        """项目下的数据发生变化，使依赖该项目的缓存失效（需在写入所在的事务中调用）"""
+        if project_id is not None:
+            self.bump_generation(project_scope(project_id))
+
+    def record_change(self, project_id: Optional[int], entity: str, entity_id: int, action: str) -> Optional[int]:
+        """
+        在写入所在的事务中追加一条变更日志（entity 为 project / prompt / version / label / prompt_tag / tag，
+        action 为 create / update / delete），并使该项目的缓存失效，返回变更 id。
+        写事务互斥执行，变更 id 按提交顺序递增，读到 id 为 N 的变更时不会再出现更小的 id。
+        """
+        if project_id is None:
+            return None
+        cursor = self.execute_query(
+            'INSERT INTO changes (project_id, entity, entity_id, action, created_at) VALUES (?, ?, ?, ?, ?)',
+            (project_id, entity, entity_id, action, now_beijing())
+        )
+        self.touch_project(project_id)
+        if entity == 'project':
+            self.bump_generation(PROJECTS_SCOPE)
+        for listener in self.change_listeners:
+            self.after_commit(listener)
+        return cursor.lastrowid
+
+    def _forget_generation(self, scope: str):
+        with self._generations_lock:
+            self._generations.pop(scope, None)
+            self._generations_epoch += 1
+
+    def enable_wal(self):
+        """切换到 WAL 日志模式：读操作不再被写操作阻塞"""
+        conn = self.get_connection()
+        mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+        if mode.lower() != 'wal':
+            raise sqlite3.OperationalError(f'无法启用 WAL 模式，当前日志模式为 {mode}')
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> Optional[Dict[str, Any]]:
+        """将 WAL 中的内容写回主数据库文件，返回 checkpoint 结果"""
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f'无效的 checkpoint 模式: {mode}')
+        conn = self.pool.acquire()
+        try:
+            busy, log_pages, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+            return {'busy': busy, 'log_pages': log_pages, 'checkpointed': checkpointed}
+        finally:
+            self.pool.release(conn)
+
+    def _checkpoint_loop(self, interval: float):
+        while not self._stop_event.wait(interval):
+            try:
+                self.checkpoint('PASSIVE')
+            except sqlite3.Error:
+                # 连接池关闭或数据库繁忙时跳过本轮，下个周期再试
+                pass
+
     def init_db(self):
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -128,6 +633,55 @@ class Database:
             )
         ''')
         
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_generations (
+                scope TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # 发布标签（如 production、canary）：每个提示词的标签指向一个具体版本，移动标签只改一行
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS prompt_labels (
+                prompt_id INTEGER NOT NULL,
+                label TEXT NOT NULL,
+                version_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (prompt_id, label)
+            ) WITHOUT ROWID
+        ''')
+        
+        # 变更日志：项目、提示词、版本、标签的每次写入在同一事务中追加一行，供客户端增量同步
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER NOT NULL,
+                entity TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 删除项目时项目的权限一并清除，删除通知的接收者（删除前可读该项目的用户）记录在这里
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_readers (
+                user_id INTEGER NOT NULL,
+                change_id INTEGER NOT NULL,
+                PRIMARY KEY (user_id, change_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # 按内容哈希去重的正文存储，refcount 由 prompts / prompt_versions 上的触发器维护
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS content_blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT,
+                data BLOB NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS prompt_tags (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -141,16 +695,255 @@ class Database:
         ''')
         
         conn.commit()
-        conn.close()
         
         self.init_default_data()
         self.migrate_db()
+        self.ensure_effective_permissions()
+        self.ensure_content_blobs()
+        self.ensure_indexes()
+        self.ensure_search_index()
+
+    def ensure_content_blobs(self):
+        """
+        创建维护 content_blobs.refcount 的触发器。引用计数与行的增删改在同一语句中完成，
+        任何写入路径都不会漏记；计数降到 0 的正文随即删除。
+        写入方先插入 refcount 为 0 的正文、再在同一事务中插入引用它的行，
+        写事务之间互斥，因此并发删除不会回收仍被引用的正文。
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        for table in ('prompts', 'prompt_versions'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_blob_insert AFTER INSERT ON {table} 
+                WHEN new.content_codec = 'blob' BEGIN
+                    UPDATE content_blobs SET refcount = refcount + 1 WHERE hash = new.content;
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_blob_delete AFTER DELETE ON {table} 
+                WHEN old.content_codec = 'blob' BEGIN
+                    UPDATE content_blobs SET refcount = refcount - 1 WHERE hash = old.content;
+                END
+            ''')
+            # 先增后减：内容未变时计数不会先降到 0
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_blob_update AFTER UPDATE OF content, content_codec ON {table} BEGIN
+                    UPDATE content_blobs SET refcount = refcount + 1 
+                    WHERE new.content_codec = 'blob' AND hash = new.content;
+                    UPDATE content_blobs SET refcount = refcount - 1 
+                    WHERE old.content_codec = 'blob' AND hash = old.content;
+                END
+            ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS content_blobs_release AFTER UPDATE OF refcount ON content_blobs 
+            WHEN new.refcount <= 0 BEGIN
+                DELETE FROM content_blobs WHERE hash = new.hash;
+            END
+        ''')
+        conn.commit()
 
-    def execute_query(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
+    def store_content(self, text: str, codec: str = DEFAULT_CONTENT_CODEC):
+        """
+        返回 text 应写入 content 列的 (值, content_codec)。较大的内容存入 content_blobs
+        （已存在则复用），需与引用它的写入处于同一事务中。
+        """
+        if len(text.encode('utf-8')) < BLOB_MIN_SIZE:
+            return text, None
+        digest = content_hash(text)
+        data, blob_codec = encode_content(text, codec)
+        self.execute_query(
+            'INSERT OR IGNORE INTO content_blobs (hash, codec, data, refcount) VALUES (?, ?, ?, 0)',
+            (digest, blob_codec, data)
+        )
+        return digest, 'blob'
+
+    def collect_blobs(self) -> int:
+        """按实际引用重算 refcount 并删除无人引用的正文（修复工具），返回删除的条数"""
+        with self.transaction():
+            before = self.fetch_one('SELECT COUNT(*) as count FROM content_blobs')['count']
+            # 计数降到 0 的正文由 content_blobs_release 触发器删除
+            self.execute_query('''
+                UPDATE content_blobs SET refcount = 
+                    (SELECT COUNT(*) FROM prompts WHERE content_codec = 'blob' AND content = content_blobs.hash) +
+                    (SELECT COUNT(*) FROM prompt_versions WHERE content_codec = 'blob' AND content = content_blobs.hash)
+            ''')
+            self.execute_query('DELETE FROM content_blobs WHERE refcount <= 0')
+            return before - self.fetch_one('SELECT COUNT(*) as count FROM content_blobs')['count']
+
+    def reencode_blobs(self, codec: str = DEFAULT_CONTENT_CODEC, batch_size: int = 100) -> int:
+        """按 codec 重新压缩 content_blobs 中的正文，分批在短事务中完成，返回改写的条数"""
+        changed = 0
+        last_hash = ''
+        while True:
+            with self.transaction():
+                rows = self.fetch_all(
+                    '''SELECT hash, codec, decode_content(data, codec) as content FROM content_blobs 
+                       WHERE hash > ? ORDER BY hash LIMIT ?''',
+                    (last_hash, batch_size)
+                )
+                for row in rows:
+                    data, blob_codec = encode_content(row['content'], codec)
+                    if blob_codec != row['codec']:
+                        self.execute_query(
+                            'UPDATE content_blobs SET codec = ?, data = ? WHERE hash = ?',
+                            (blob_codec, data, row['hash'])
+                        )
+                        changed += 1
+            if len(rows) < batch_size:
+                return changed
+            last_hash = rows[-1]['hash']
+
+    def ensure_effective_permissions(self):
+        """
+        创建用户 × 项目的有效权限表 effective_permissions，以及根据
+        project_permissions / user_groups 计算有效权限的视图 effective_permissions_source。
+        表新建时从视图全量生成，之后由各个写操作调用 refresh_effective_permissions 增量维护。
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute(query, params)
+        
+        cursor.execute('DROP VIEW IF EXISTS effective_permissions_source')
+        cursor.execute('''
+            CREATE VIEW effective_permissions_source AS
+            SELECT src.user_id, src.project_id,
+                   CASE MAX(src.rank) WHEN 2 THEN 'readwrite' ELSE 'read' END AS level
+            FROM (
+                SELECT pp.user_id, pp.project_id,
+                       CASE WHEN pp.permission_level = 'readwrite' THEN 2 ELSE 1 END AS rank
+                FROM project_permissions pp
+                WHERE pp.user_id IS NOT NULL
+                UNION ALL
+                SELECT ug.user_id, pp.project_id,
+                       CASE WHEN pp.permission_level = 'readwrite' THEN 2 ELSE 1 END AS rank
+                FROM project_permissions pp
+                JOIN groups g ON g.id = pp.group_id
+                JOIN user_groups ug ON ug.group_id = pp.group_id
+            ) src
+            JOIN users u ON u.id = src.user_id
+            JOIN projects p ON p.id = src.project_id
+            GROUP BY src.user_id, src.project_id
+        ''')
+        
+        cursor.execute("SELECT COUNT(*) as count FROM sqlite_master WHERE type = 'table' AND name = 'effective_permissions'")
+        exists = cursor.fetchone()['count'] > 0
+        if not exists:
+            cursor.execute('''
+                CREATE TABLE effective_permissions (
+                    user_id INTEGER NOT NULL,
+                    project_id INTEGER NOT NULL,
+                    level TEXT NOT NULL,
+                    PRIMARY KEY (user_id, project_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                INSERT INTO effective_permissions (user_id, project_id, level)
+                SELECT user_id, project_id, level FROM effective_permissions_source
+            ''')
         conn.commit()
+
+    def refresh_effective_permissions(self, user_id: int = None, project_id: int = None):
+        """
+        从源表重新计算指定用户或项目的有效权限（都不指定时全量重建）。
+        应与修改源表的语句放在同一个事务中调用。
+        """
+        if user_id is not None:
+            where, params = 'WHERE user_id = ?', (user_id,)
+        elif project_id is not None:
+            where, params = 'WHERE project_id = ?', (project_id,)
+        else:
+            where, params = '', ()
+        
+        with self.transaction():
+            self.execute_query(f'DELETE FROM effective_permissions {where}', params)
+            self.execute_query(
+                f'''INSERT INTO effective_permissions (user_id, project_id, level)
+                    SELECT user_id, project_id, level FROM effective_permissions_source {where}''',
+                params
+            )
+
+    def check_effective_permissions(self) -> List[Dict[str, Any]]:
+        """一致性检查：返回 effective_permissions 与源表计算结果不一致的记录，为空表示一致"""
+        return self.fetch_all('''
+            SELECT e.user_id, e.project_id, e.level AS stored_level, s.level AS expected_level
+            FROM effective_permissions e
+            LEFT JOIN effective_permissions_source s
+                   ON s.user_id = e.user_id AND s.project_id = e.project_id
+            WHERE s.level IS NULL OR s.level != e.level
+            UNION ALL
+            SELECT s.user_id, s.project_id, NULL, s.level
+            FROM effective_permissions_source s
+            LEFT JOIN effective_permissions e
+                   ON e.user_id = s.user_id AND e.project_id = s.project_id
+            WHERE e.level IS NULL
+        ''')
+
+    def in_transaction(self) -> bool:
+        return getattr(self._local, 'tx_depth', 0) > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        在一个 BEGIN IMMEDIATE 事务中执行多条写操作，只提交一次；
+        事务内的 execute_query 不再单独提交，嵌套调用并入最外层事务。
+        """
+        conn = self.get_connection()
+        depth = getattr(self._local, 'tx_depth', 0)
+        if depth == 0:
+            if conn.in_transaction:
+                conn.commit()
+            self._begin_immediate(conn)
+            self._local.after_commit = []
+        self._local.tx_depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.tx_depth = depth
+            if depth == 0:
+                conn.rollback()
+                self._local.after_commit = []
+            raise
+        self._local.tx_depth = depth
+        if depth == 0:
+            conn.commit()
+            callbacks, self._local.after_commit = self._local.after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def _begin_immediate(self, conn: sqlite3.Connection):
+        """
+        获取写锁。SQLite 自带的 busy handler 在 C 代码中休眠，gevent worker 下会卡住整个进程的事件循环
+        （包括所有 SSE 连接），因此等待写锁时关闭它，改为在 Python 中退避重试，time.sleep 会让出事件循环。
+        """
+        busy_timeout = self.pool.busy_timeout
+        conn.execute('PRAGMA busy_timeout = 0')
+        try:
+            deadline = time.monotonic() + busy_timeout
+            delay = 0.001
+            while True:
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    return
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) or time.monotonic() >= deadline:
+                        raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        finally:
+            conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+
+    def after_commit(self, callback):
+        """当前事务提交后执行 callback（事务回滚则不执行）；不在事务中时立即执行"""
+        if self.in_transaction():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    def execute_query(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
+        # 不在事务中的单条写入也通过 transaction 获取写锁，等待时同样不会卡住事件循环
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
         return cursor
 
     def fetch_all(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
@@ -158,7 +951,6 @@ class Database:
         cursor = conn.cursor()
         cursor.execute(query, params)
         rows = cursor.fetchall()
-        conn.close()
         return [dict(row) for row in rows]
 
     def fetch_one(self, query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
@@ -166,7 +958,6 @@ class Database:
         cursor = conn.cursor()
         cursor.execute(query, params)
         row = cursor.fetchone()
-        conn.close()
         return dict(row) if row else None
 
     def init_default_data(self):
@@ -195,8 +986,6 @@ class Database:
                          (admin_user['id'], admin_group['id']))
             
             conn.commit()
-        
-        conn.close()
 
     def migrate_db(self):
         conn = self.get_connection()
@@ -243,15 +1032,124 @@ class Database:
             cursor.execute('DROP TABLE tags_old')
             conn.commit()
         
+        # 大段内容压缩存储，content_codec 记录编码方式（见 CONTENT_CODECS）
+        cursor.execute("PRAGMA table_info(prompts)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'content_codec' not in columns:
+            cursor.execute('ALTER TABLE prompts ADD COLUMN content_codec TEXT')
+            conn.commit()
+        
+        # 版本内容改为“关键帧 + 增量”存储：content_codec 为 'delta' 时，
+        # content 是相对 base_version_id 对应关键帧的增量；关键帧可以压缩
+        cursor.execute("PRAGMA table_info(prompt_versions)")
+        columns = [column[1] for column in cursor.fetchall()]
+        
+        if 'content_codec' not in columns:
+            cursor.execute('ALTER TABLE prompt_versions ADD COLUMN content_codec TEXT')
+            cursor.execute('ALTER TABLE prompt_versions ADD COLUMN base_version_id INTEGER')
+            conn.commit()
+        
+        # 补全历史版本缺失的 project_id
+        cursor.execute('''
+            UPDATE prompt_versions SET project_id = (SELECT project_id FROM prompts WHERE id = prompt_versions.prompt_id)
+            WHERE project_id IS NULL
+        ''')
+        
+        # 并发编辑曾产生重复的版本号，建立 (prompt_id, version_number) 唯一索引前按顺序重新编号
+        cursor.execute('''
+            SELECT DISTINCT prompt_id FROM prompt_versions 
+            GROUP BY prompt_id, version_number HAVING COUNT(*) > 1
+        ''')
+        for row in cursor.fetchall():
+            cursor.execute('''
+                UPDATE prompt_versions SET version_number = (
+                    SELECT r.rn FROM (
+                        SELECT id, ROW_NUMBER() OVER (ORDER BY version_number, id) AS rn
+                        FROM prompt_versions WHERE prompt_id = ?
+                    ) r WHERE r.id = prompt_versions.id
+                )
+                WHERE prompt_id = ?
+            ''', (row['prompt_id'], row['prompt_id']))
+        
         # 将没有关联提示词的标签标记为失效
         cursor.execute('''
             UPDATE tags SET active = 0 
             WHERE active = 1 AND id NOT IN (SELECT DISTINCT tag_id FROM prompt_tags)
         ''')
-        if cursor.rowcount > 0:
-            conn.commit()
+        conn.commit()
+
+    @staticmethod
+    def _index_sql(name: str, definition: str) -> str:
+        if definition.startswith('UNIQUE '):
+            return f'CREATE UNIQUE INDEX {name} ON {definition[len("UNIQUE "):]}'
+        return f'CREATE INDEX {name} ON {definition}'
+
+    def ensure_indexes(self):
+        """创建缺失的索引，重建定义已变化的索引，删除不再维护的 idx_ 索引"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx!_%' ESCAPE '!'")
+        existing = {row['name']: row['sql'] for row in cursor.fetchall()}
+        expected = {name: self._index_sql(name, definition) for name, definition in self.INDEXES.items()}
+
+        changed = False
+        for name, sql in existing.items():
+            if sql != expected.get(name):
+                cursor.execute(f'DROP INDEX {name}')
+                changed = True
+
+        for name, sql in expected.items():
+            if existing.get(name) != sql:
+                cursor.execute(sql)
+                changed = True
+
+        if changed:
+            # 索引变化后刷新统计信息，帮助查询规划器选择新索引
+            cursor.execute('ANALYZE')
+        conn.commit()
+
+    def ensure_search_index(self):
+        """
+        创建提示词全文索引 prompts_fts（FTS5 + trigram 分词，中文无需分词即可匹配），
+        由 PromptModel 的增删改在同一事务中同步。SQLite 不支持 FTS5 时退回 LIKE 搜索。
+        prompts.content 可能被压缩或只是 content_blobs 的哈希，索引表自己保存还原后的标题和正文，
+        trigram 无法索引的短关键词也直接在其中用 LIKE 匹配，不需要逐行解压。
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
-        conn.close()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'prompts_fts'")
+        existing = cursor.fetchone()
+        if existing and "content='prompts'" in existing['sql']:
+            # 旧版本是以 prompts 为外部内容的索引表，改为自己保存文本后重建
+            cursor.execute('DROP TABLE prompts_fts')
+            existing = None
+        
+        if not existing:
+            try:
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE prompts_fts USING fts5(
+                        title, content,
+                        tokenize='trigram'
+                    )
+                ''')
+            except sqlite3.OperationalError:
+                # 缺少 fts5 模块或 trigram 分词器（SQLite < 3.34）
+                conn.rollback()
+                return
+            cursor.execute(f'''
+                INSERT INTO prompts_fts (rowid, title, content) 
+                SELECT id, title, {content_expr()} FROM prompts
+            ''')
+        
+        # 旧版本由触发器同步索引，触发器调用只在本应用连接上注册的 decode_content，
+        # 其他 sqlite3 连接改写 prompts 时会报错，改为由 PromptModel 在写入的同一事务中维护
+        for name in ('prompts_fts_insert', 'prompts_fts_delete', 'prompts_fts_update', 'prompts_fts_update_old'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.commit()
+        self.fts_enabled = True
 
 
 class ProjectModel:
@@ -260,15 +1158,19 @@ class ProjectModel:
 
     def create(self, name: str, description: str = '') -> int:
         now = now_beijing()
-        cursor = self.db.execute_query(
-            'INSERT INTO projects (name, description, created_at, updated_at) VALUES (?, ?, ?, ?)',
-            (name, description, now, now)
-        )
+        with self.db.transaction():
+            cursor = self.db.execute_query(
+                'INSERT INTO projects (name, description, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                (name, description, now, now)
+            )
+            self.db.record_change(cursor.lastrowid, 'project', cursor.lastrowid, 'create')
         return cursor.lastrowid
 
+    @cached_query(lambda self: PROJECTS_SCOPE)
     def get_all(self) -> List[Dict[str, Any]]:
         return self.db.fetch_all('SELECT * FROM projects ORDER BY created_at DESC')
 
+    @cached_query(lambda self, project_id: project_scope(project_id))
     def get_by_id(self, project_id: int) -> Optional[Dict[str, Any]]:
         return self.db.fetch_one('SELECT * FROM projects WHERE id = ?', (project_id,))
 
@@ -291,43 +1193,176 @@ class ProjectModel:
         params.append(project_id)
         
         query = f'UPDATE projects SET {", ".join(updates)} WHERE id = ?'
-        self.db.execute_query(query, tuple(params))
+        with self.db.transaction():
+            self.db.execute_query(query, tuple(params))
+            self.db.record_change(project_id, 'project', project_id, 'update')
         return True
 
     def delete(self, project_id: int) -> bool:
-        self.db.execute_query('DELETE FROM projects WHERE id = ?', (project_id,))
+        with self.db.transaction():
+            change_id = self.db.record_change(project_id, 'project', project_id, 'delete')
+            # 权限随项目清除之前记下可读该项目的用户，删除通知只发给他们
+            self.db.execute_query(
+                'INSERT INTO change_readers (user_id, change_id) SELECT user_id, ? FROM effective_permissions WHERE project_id = ?',
+                (change_id, project_id)
+            )
+            self.db.execute_query('DELETE FROM projects WHERE id = ?', (project_id,))
+            self.db.refresh_effective_permissions(project_id=project_id)
         return True
 
+    def get_bundle(self, project_id: int, labels: Tuple[str, ...] = ()) -> Optional[Dict[str, Any]]:
+        """
+        项目的完整数据包：项目信息、全部提示词（含内容和标签），以及 labels 中各发布标签
+        指向的版本内容。查询次数与提示词数量无关。项目不存在时返回 None。
+        """
+        project = self.get_by_id(project_id)
+        if not project:
+            return None
+        
+        prompts = self.db.fetch_all(
+            f'''SELECT {select_fields(None, PromptModel.COLUMNS)} FROM prompts 
+               WHERE project_id = ? ORDER BY created_at DESC, id DESC''',
+            (project_id,)
+        )
+        tags = TagModel(self.db).get_tags_for_prompts([p['id'] for p in prompts])
+        
+        pinned = []
+        if labels:
+            placeholders = ','.join(['?' for _ in labels])
+            pinned = self.db.fetch_all(
+                f'''SELECT l.prompt_id, l.label, l.version_id, v.version_number 
+                   FROM prompt_labels l 
+                   JOIN prompts p ON p.id = l.prompt_id 
+                   JOIN prompt_versions v ON v.id = l.version_id 
+                   WHERE p.project_id = ? AND l.label IN ({placeholders})''',
+                (project_id, *labels)
+            )
+        contents = PromptVersionModel(self.db).get_contents([row['version_id'] for row in pinned])
+        labels_by_prompt = {}
+        for row in pinned:
+            labels_by_prompt.setdefault(row['prompt_id'], {})[row['label']] = {
+                'version_id': row['version_id'],
+                'version_number': row['version_number'],
+                'content': contents[row['version_id']],
+            }
+        
+        for prompt in prompts:
+            prompt['tags'] = [{'id': tag['id'], 'name': tag['name']} for tag in tags[prompt['id']]]
+            prompt['labels'] = labels_by_prompt.get(prompt['id'], {})
+        return {'project': project, 'prompts': prompts}
+
 
 class PromptModel:
-    def __init__(self, db: Database):
+    COLUMNS = ('id', 'project_id', 'title', 'content', 'created_at', 'updated_at')
+    # 详情页版本列表只需要的字段，内容在选中某个版本时再按版本 id 获取
+    VERSION_SUMMARY_FIELDS = ['id', 'version_number', 'version_name', 'title', 'created_at']
+    # 版本标签 vN 表示第 N 个版本
+    VERSION_NUMBER_LABEL = re.compile(r'v(\d+)')
+
+    def __init__(self, db: Database, resolve_cache_size: int = 4096):
         self.db = db
+        # (项目名, 标题, 版本标签) -> (project_id, 代数, 内容)，项目代数变化后失效
+        self._resolve_cache = LRUCache(resolve_cache_size)
 
     def create(self, project_id: int, title: str, content: str) -> int:
         now = now_beijing()
-        cursor = self.db.execute_query(
-            'INSERT INTO prompts (project_id, title, content, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
-            (project_id, title, content, now, now)
-        )
+        with self.db.transaction():
+            stored, codec = self.db.store_content(content)
+            cursor = self.db.execute_query(
+                'INSERT INTO prompts (project_id, title, content, content_codec, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (project_id, title, stored, codec, now, now)
+            )
+            self._index(cursor.lastrowid, title, content)
+            self.db.record_change(project_id, 'prompt', cursor.lastrowid, 'create')
         return cursor.lastrowid
 
+    def _index(self, prompt_id: int, title: str, content: str):
+        """把提示词加入全文索引，需与写入 prompts 处于同一事务中"""
+        if self.db.fts_enabled:
+            self.db.execute_query(
+                'INSERT INTO prompts_fts (rowid, title, content) VALUES (?, ?, ?)',
+                (prompt_id, title, content)
+            )
+
+    def _reindex(self, prompt_id: int, title: Optional[str], content: Optional[str]):
+        """更新全文索引中提示词的标题和正文，为 None 的字段保持不变"""
+        if self.db.fts_enabled:
+            self.db.execute_query(
+                'UPDATE prompts_fts SET title = coalesce(?, title), content = coalesce(?, content) WHERE rowid = ?',
+                (title, content, prompt_id)
+            )
+
+    def _unindex(self, prompt_id: int):
+        if self.db.fts_enabled:
+            self.db.execute_query('DELETE FROM prompts_fts WHERE rowid = ?', (prompt_id,))
+
+    def _record_change(self, prompt_id: int, action: str, entity: str = 'prompt'):
+        project_id = self.get_project_id(prompt_id)
+        if project_id is not None:
+            self.db.record_change(project_id, entity, prompt_id, action)
+
+    def get_project_id(self, prompt_id: int) -> Optional[int]:
+        """只查询提示词所属的项目（不读取内容），提示词不存在时返回 None"""
+        row = self.db.fetch_one('SELECT project_id FROM prompts WHERE id = ?', (prompt_id,))
+        return row['project_id'] if row else None
+
     def get_all(self, project_id: int = None) -> List[Dict[str, Any]]:
+        return self.get_page(project_id)[0]
+
+    @cached_query(lambda self, project_id=None, *args, **kwargs: project_scope(project_id) if project_id else None)
+    def get_page(self, project_id: int = None, limit: int = None, cursor: str = None,
+                 fields: List[str] = None):
+        """按 (created_at, id) 倒序做游标分页，返回 (提示词列表, next_cursor)"""
+        columns = select_fields(fields, self.COLUMNS, required=('id', 'created_at'))
+        conditions = []
+        params = []
+        
         if project_id:
-            return self.db.fetch_all(
-                'SELECT * FROM prompts WHERE project_id = ? ORDER BY created_at DESC',
-                (project_id,)
-            )
-        return self.db.fetch_all('SELECT * FROM prompts ORDER BY created_at DESC')
+            conditions.append('project_id = ?')
+            params.append(project_id)
+        if cursor:
+            conditions.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(cursor, 2))
+        
+        query = f'SELECT {columns} FROM prompts'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC, id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        
+        rows = self.db.fetch_all(query, tuple(params))
+        return paginate(rows, limit, ('created_at', 'id'))
 
+    @cached_query(lambda self, prompt_id: self.db.prompt_scope(prompt_id))
     def get_by_id(self, prompt_id: int) -> Optional[Dict[str, Any]]:
+        columns = select_fields(None, self.COLUMNS, alias='p.')
         return self.db.fetch_one(
-            '''SELECT p.*, proj.name as project_name 
+            f'''SELECT {columns}, proj.name as project_name 
                FROM prompts p 
                JOIN projects proj ON p.project_id = proj.id 
                WHERE p.id = ?''',
             (prompt_id,)
         )
 
+    def get_view(self, prompt_id: int) -> Optional[Dict[str, Any]]:
+        """
+        提示词详情页所需的全部数据：提示词（含项目名）、提示词的标签、项目的全部标签和版本摘要列表。
+        各部分都经过查询缓存，缓存未命中时在同一个连接上依次查询。提示词不存在时返回 None。
+        """
+        prompt = self.get_by_id(prompt_id)
+        if not prompt:
+            return None
+        tag_model = TagModel(self.db)
+        versions, _ = PromptVersionModel(self.db).get_page(prompt_id, fields=self.VERSION_SUMMARY_FIELDS)
+        return {
+            'prompt': prompt,
+            'tags': tag_model.get_prompt_tags(prompt_id),
+            'project_tags': tag_model.get_project_tags(prompt['project_id']),
+            'versions': versions,
+        }
+
     def update(self, prompt_id: int, title: str = None, content: str = None) -> bool:
         updates = []
         params = []
@@ -335,35 +1370,186 @@ class PromptModel:
         if title is not None:
             updates.append('title = ?')
             params.append(title)
-        if content is not None:
-            updates.append('content = ?')
-            params.append(content)
-        
-        if not updates:
-            return False
-        
-        updates.append('updated_at = ?')
-        params.append(now_beijing())
-        params.append(prompt_id)
-        
-        query = f'UPDATE prompts SET {", ".join(updates)} WHERE id = ?'
-        self.db.execute_query(query, tuple(params))
+        with self.db.transaction():
+            if content is not None:
+                updates.append('content = ?, content_codec = ?')
+                params.extend(self.db.store_content(content))
+            
+            if not updates:
+                return False
+            
+            updates.append('updated_at = ?')
+            params.append(now_beijing())
+            params.append(prompt_id)
+            
+            query = f'UPDATE prompts SET {", ".join(updates)} WHERE id = ?'
+            self.db.execute_query(query, tuple(params))
+            self._reindex(prompt_id, title, content)
+            self._record_change(prompt_id, 'update')
         return True
 
+    def update_with_version(self, prompt_id: int, title: str = None, content: str = None) -> Optional[int]:
+        """
+        先把当前内容保存为新版本，再更新提示词。读取、快照和更新在同一个
+        BEGIN IMMEDIATE 事务中完成并只提交一次，并发编辑不会产生重复的版本号。
+        标题和内容都没有变化时不创建版本，返回当前版本号。
+        返回新版本号，提示词不存在时返回 None。
+        """
+        versions = PromptVersionModel(self.db)
+        with self.db.transaction():
+            prompt = self.db.fetch_one(
+                f'''SELECT title, content as stored, content_codec, {content_expr()} as content 
+                   FROM prompts WHERE id = ?''', (prompt_id,)
+            )
+            if not prompt:
+                return None
+            if self._unchanged(prompt, title, content):
+                return versions.get_current_version_number(prompt_id)
+            version_number = versions.get_current_version_number(prompt_id) + 1
+            versions.create(prompt_id, version_number, prompt['title'], prompt['content'])
+            self.update(prompt_id, title, content)
+        return version_number
+
+    @staticmethod
+    def _unchanged(prompt: Dict[str, Any], title: Optional[str], content: Optional[str]) -> bool:
+        """判断更新是否不会改变提示词；存入 content_blobs 的内容只需比较哈希"""
+        if title is not None and title != prompt['title']:
+            return False
+        if content is None:
+            return True
+        if prompt['content_codec'] == 'blob':
+            return content_hash(content) == prompt['stored']
+        return content == prompt['content']
+
     def delete(self, prompt_id: int) -> bool:
-        self.db.execute_query('DELETE FROM prompts WHERE id = ?', (prompt_id,))
+        with self.db.transaction():
+            self._record_change(prompt_id, 'delete')
+            self._unindex(prompt_id)
+            self.db.execute_query('DELETE FROM prompt_labels WHERE prompt_id = ?', (prompt_id,))
+            self.db.execute_query('DELETE FROM prompts WHERE id = ?', (prompt_id,))
         return True
 
+    def resolve(self, project_name: str, title: str, label: str = None) -> Optional[Tuple[int, str]]:
+        """
+        按项目名、标题和可选的版本标签（发布标签、版本名称或 vN）解析提示词内容，返回 (project_id, 内容)。
+        同一项目下有同名提示词时取最新创建的。结果缓存在进程内，
+        项目下的任何写入都会递增项目代数（包括其他 worker 进程的写入），缓存随之失效。
+        """
+        key = (project_name, title, label)
+        cached = self._resolve_cache.get(key)
+        if cached is not None:
+            project_id, generation, content = cached
+            if self.db.get_generation(project_scope(project_id)) == generation:
+                return project_id, content
+        
+        project = self.db.fetch_one('SELECT id FROM projects WHERE name = ?', (project_name,))
+        if not project:
+            return None
+        project_id = project['id']
+        # 先取代数再读数据：读取期间发生的写入会使这次缓存的结果在下次访问时失效
+        generation = self.db.get_generation(project_scope(project_id))
+        
+        prompt = self.db.fetch_one(
+            f'''SELECT id, {content_expr()} as content FROM prompts 
+               WHERE project_id = ? AND title = ? ORDER BY created_at DESC, id DESC LIMIT 1''',
+            (project_id, title)
+        )
+        if not prompt:
+            return None
+        
+        content = prompt['content']
+        if label is not None:
+            content = self._resolve_version(prompt['id'], label)
+            if content is None:
+                return None
+        
+        self._resolve_cache.set(key, (project_id, generation, content))
+        return project_id, content
+
+    def _resolve_version(self, prompt_id: int, label: str) -> Optional[str]:
+        """版本标签依次匹配发布标签、版本名称和 vN 版本号"""
+        version = self.db.fetch_one(
+            'SELECT version_id as id FROM prompt_labels WHERE prompt_id = ? AND label = ?',
+            (prompt_id, label)
+        )
+        if not version:
+            version = self.db.fetch_one(
+                '''SELECT id FROM prompt_versions WHERE prompt_id = ? AND version_name = ? 
+                   ORDER BY version_number DESC LIMIT 1''',
+                (prompt_id, label)
+            )
+        match = self.VERSION_NUMBER_LABEL.fullmatch(label)
+        if not version and match:
+            version = self.db.fetch_one(
+                'SELECT id FROM prompt_versions WHERE prompt_id = ? AND version_number = ?',
+                (prompt_id, int(match.group(1)))
+            )
+        if not version:
+            return None
+        return PromptVersionModel(self.db).get_by_id(version['id'])['content']
+
+    def reencode(self, codec: str = DEFAULT_CONTENT_CODEC, batch_size: int = 100) -> int:
+        """
+        把已有提示词的内容改存到 content_blobs（新正文按 codec 压缩），返回改写的行数。
+        每批在独立的短事务中完成，可以在服务运行期间执行。
+        """
+        changed = 0
+        last_id = 0
+        while True:
+            with self.db.transaction():
+                rows = self.db.fetch_all(
+                    f'''SELECT id, content as stored, content_codec, {content_expr()} as content FROM prompts 
+                       WHERE id > ? ORDER BY id LIMIT ?''',
+                    (last_id, batch_size)
+                )
+                for row in rows:
+                    stored, new_codec = self.db.store_content(row['content'], codec)
+                    if (stored, new_codec) != (row['stored'], row['content_codec']):
+                        self.db.execute_query(
+                            'UPDATE prompts SET content = ?, content_codec = ? WHERE id = ?',
+                            (stored, new_codec, row['id'])
+                        )
+                        changed += 1
+            if len(rows) < batch_size:
+                return changed
+            last_id = rows[-1]['id']
+
+    # trigram 分词器只能匹配长度不少于 3 个字符的关键词
+    FTS_MIN_KEYWORD_LENGTH = 3
+
     def search(self, keywords: List[str], project_ids: List[int] = None) -> List[Dict[str, Any]]:
-        """按关键词搜索提示词标题和内容，所有关键词必须同时匹配（AND逻辑）"""
+        return self.search_page(keywords, project_ids)[0]
+
+    def search_page(self, keywords: List[str], project_ids: List[int] = None,
+                    limit: int = None, cursor: str = None, fields: List[str] = None):
+        """
+        按关键词搜索提示词标题和内容，所有关键词必须同时匹配（AND逻辑）。
+        长度足够的关键词走全文索引并按 bm25 相关度排序，过短的关键词用 LIKE 过滤
+        （有全文索引时匹配索引表中保存的文本，否则逐行还原 content）。返回 (提示词列表, next_cursor)。
+        """
         if not keywords:
-            return []
+            return [], None
+        
+        fts_keywords = []
+        like_keywords = list(keywords)
+        if self.db.fts_enabled:
+            fts_keywords = [kw for kw in keywords if len(kw) >= self.FTS_MIN_KEYWORD_LENGTH]
+            like_keywords = [kw for kw in keywords if len(kw) < self.FTS_MIN_KEYWORD_LENGTH]
         
         conditions = []
         params = []
         
-        for kw in keywords:
-            conditions.append('(p.title LIKE ? OR p.content LIKE ?)')
+        if fts_keywords:
+            # 每个关键词作为一个短语，双引号转义后用 AND 连接
+            match = ' AND '.join('"' + kw.replace('"', '""') + '"' for kw in fts_keywords)
+            conditions.append('prompts_fts MATCH ?')
+            params.append(match)
+        
+        for kw in like_keywords:
+            if self.db.fts_enabled:
+                conditions.append('(prompts_fts.title LIKE ? OR prompts_fts.content LIKE ?)')
+            else:
+                conditions.append(f'(p.title LIKE ? OR {content_expr("p.")} LIKE ?)')
             params.append(f'%{kw}%')
             params.append(f'%{kw}%')
         
@@ -374,40 +1560,303 @@ class PromptModel:
             where_clause += f' AND p.project_id IN ({placeholders})'
             params.extend(project_ids)
         
-        query = f'''SELECT p.*, proj.name as project_name 
-                    FROM prompts p 
-                    JOIN projects proj ON p.project_id = proj.id 
-                    WHERE {where_clause} 
-                    ORDER BY p.updated_at DESC'''
-        return self.db.fetch_all(query, tuple(params))
+        if fts_keywords:
+            if cursor:
+                where_clause += ' AND (bm25(prompts_fts), p.id) > (?, ?)'
+                params.extend(decode_cursor(cursor, 2))
+            columns = select_fields(fields, self.COLUMNS, required=('id',), alias='p.',
+                                    extra={'project_name': 'proj.name'}, content='prompts_fts.content')
+            query = f'''SELECT {columns}, bm25(prompts_fts) as _rank 
+                        FROM prompts_fts 
+                        JOIN prompts p ON p.id = prompts_fts.rowid 
+                        JOIN projects proj ON p.project_id = proj.id 
+                        WHERE {where_clause} 
+                        ORDER BY _rank, p.id'''
+            sort_keys = ('_rank', 'id')
+        else:
+            if cursor:
+                where_clause += ' AND (p.updated_at, p.id) < (?, ?)'
+                params.extend(decode_cursor(cursor, 2))
+            # 有全文索引时正文直接取索引表中保存的文本
+            fts = self.db.fts_enabled
+            columns = select_fields(fields, self.COLUMNS, required=('id', 'updated_at'), alias='p.',
+                                    extra={'project_name': 'proj.name'},
+                                    content='prompts_fts.content' if fts else None)
+            join_fts = 'JOIN prompts_fts ON prompts_fts.rowid = p.id' if fts else ''
+            query = f'''SELECT {columns} 
+                        FROM prompts p 
+                        {join_fts} 
+                        JOIN projects proj ON p.project_id = proj.id 
+                        WHERE {where_clause} 
+                        ORDER BY p.updated_at DESC, p.id DESC'''
+            sort_keys = ('updated_at', 'id')
+        
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        
+        rows, next_cursor = paginate(self.db.fetch_all(query, tuple(params)), limit, sort_keys)
+        for row in rows:
+            row.pop('_rank', None)
+        return rows, next_cursor
 
 
 class PromptVersionModel:
-    def __init__(self, db: Database):
+    COLUMNS = ('id', 'prompt_id', 'project_id', 'version_number', 'title', 'content', 'version_name', 'created_at')
+    # 每个关键帧之后最多跟随的增量版本数
+    KEYFRAME_INTERVAL = 20
+    # 内容短于此长度时直接保存完整内容
+    DELTA_MIN_SIZE = 256
+    # 批量读取版本内容时每条 IN 查询的 id 数
+    BATCH_SIZE = 500
+
+    def __init__(self, db: Database, cache_size: int = 512, diff_cache_size: int = 256):
         self.db = db
+        # 版本不可变，按版本 id 缓存还原后的完整内容和版本间的差异
+        self._content_cache = LRUCache(cache_size)
+        self._diff_cache = LRUCache(diff_cache_size)
 
     def create(self, prompt_id: int, version_number: int, title: str, content: str, version_name: str = None) -> int:
         now = now_beijing()
-        cursor = self.db.execute_query(
-            'INSERT INTO prompt_versions (prompt_id, version_number, title, content, version_name, created_at) VALUES (?, ?, ?, ?, ?, ?)',
-            (prompt_id, version_number, title, content, version_name, now)
-        )
+        with self.db.transaction():
+            stored, codec, base_version_id = self._encode(prompt_id, content)
+            cursor = self.db.execute_query(
+                '''INSERT INTO prompt_versions (prompt_id, project_id, version_number, title, content, 
+                                                content_codec, base_version_id, version_name, created_at) 
+                   VALUES (?, (SELECT project_id FROM prompts WHERE id = ?), ?, ?, ?, ?, ?, ?, ?)''',
+                (prompt_id, prompt_id, version_number, title, stored, codec, base_version_id, version_name, now)
+            )
+            self._record_change(cursor.lastrowid, 'create')
         return cursor.lastrowid
 
-    def get_all(self, prompt_id: int) -> List[Dict[str, Any]]:
-        return self.db.fetch_all(
-            'SELECT * FROM prompt_versions WHERE prompt_id = ? ORDER BY version_number DESC',
+    def _record_change(self, version_id: int, action: str):
+        row = self.db.fetch_one('SELECT project_id FROM prompt_versions WHERE id = ?', (version_id,))
+        if row:
+            self.db.record_change(row['project_id'], 'version', version_id, action)
+
+    def _encode(self, prompt_id: int, content: str):
+        """
+        决定新版本的存储方式，返回 (content 列的值, content_codec, base_version_id)。
+        相对最近关键帧的增量足够小时保存增量，否则保存为新的关键帧（较大时存入 content_blobs）。
+        """
+        full = (*self.db.store_content(content), None)
+        if len(content) < self.DELTA_MIN_SIZE:
+            return full
+        
+        keyframe = self.db.fetch_one(
+            f'''SELECT id, {content_expr()} as content FROM prompt_versions 
+               WHERE prompt_id = ? AND IFNULL(content_codec, '') != 'delta' 
+               ORDER BY version_number DESC LIMIT 1''',
             (prompt_id,)
         )
+        if not keyframe:
+            return full
+        
+        followers = self.db.fetch_one(
+            'SELECT COUNT(*) as count FROM prompt_versions WHERE base_version_id = ?',
+            (keyframe['id'],)
+        )
+        if followers['count'] >= self.KEYFRAME_INTERVAL:
+            return full
+        
+        delta = make_delta(keyframe['content'], content)
+        if len(delta) * 2 > len(content):
+            return full
+        return delta, 'delta', keyframe['id']
+
+    def _columns(self) -> str:
+        """读取完整版本时的列：解压后的 content 加上还原增量所需的存储字段"""
+        return select_fields(None, self.COLUMNS) + ', content_codec, base_version_id'
+
+    def _inflate(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """把增量存储的版本还原为完整内容，并去掉内部存储字段"""
+        pending = []
+        for row in rows:
+            if row.get('content_codec') == 'delta':
+                cached = self._content_cache.get(row['id'])
+                if cached is not None:
+                    row['content'] = cached
+                else:
+                    pending.append(row)
+        
+        if pending:
+            bases = {}
+            missing = []
+            for base_id in {row['base_version_id'] for row in pending}:
+                cached = self._content_cache.get(base_id)
+                if cached is not None:
+                    bases[base_id] = cached
+                else:
+                    missing.append(base_id)
+            if missing:
+                placeholders = ','.join(['?' for _ in missing])
+                for base in self.db.fetch_all(
+                    f'SELECT id, {content_expr()} as content FROM prompt_versions WHERE id IN ({placeholders})',
+                    tuple(missing)
+                ):
+                    bases[base['id']] = base['content']
+                    self._content_cache.set(base['id'], base['content'])
+            for row in pending:
+                row['content'] = apply_delta(bases[row['base_version_id']], row['content'])
+                self._content_cache.set(row['id'], row['content'])
+        
+        for row in rows:
+            row.pop('content_codec', None)
+            row.pop('base_version_id', None)
+        return rows
+
+    def get_all(self, prompt_id: int) -> List[Dict[str, Any]]:
+        return self.get_page(prompt_id)[0]
+
+    @cached_query(lambda self, prompt_id, *args, **kwargs: self.db.prompt_scope(prompt_id))
+    def get_page(self, prompt_id: int, limit: int = None, cursor: str = None,
+                 fields: List[str] = None):
+        """按 (version_number, id) 倒序做游标分页，返回 (版本列表, next_cursor)"""
+        # 增量版本无法在 SQL 中截取摘要，preview 由还原后的内容生成
+        preview = fields is not None and 'preview' in fields
+        keep_content = fields is None or 'content' in fields
+        with_content = keep_content or preview
+        if preview:
+            fields = [f for f in fields if f != 'preview'] + ([] if keep_content else ['content'])
+        columns = select_fields(fields, self.COLUMNS, required=('id', 'version_number'))
+        if with_content:
+            columns += ', content_codec, base_version_id'
+        
+        query = f'SELECT {columns} FROM prompt_versions WHERE prompt_id = ?'
+        params = [prompt_id]
+        if cursor:
+            query += ' AND (version_number, id) < (?, ?)'
+            params.extend(decode_cursor(cursor, 2))
+        query += ' ORDER BY version_number DESC, id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        
+        rows, next_cursor = paginate(self.db.fetch_all(query, tuple(params)), limit, ('version_number', 'id'))
+        self._inflate(rows)
+        if preview:
+            for row in rows:
+                row['preview'] = row['content'][:PREVIEW_LENGTH]
+                if not keep_content:
+                    del row['content']
+        return rows, next_cursor
 
     def get_by_id(self, version_id: int) -> Optional[Dict[str, Any]]:
-        return self.db.fetch_one('SELECT * FROM prompt_versions WHERE id = ?', (version_id,))
+        row = self.db.fetch_one(
+            f'SELECT {self._columns()} FROM prompt_versions WHERE id = ?', (version_id,)
+        )
+        return self._inflate([row])[0] if row else None
 
     def get_latest_version(self, prompt_id: int) -> Optional[Dict[str, Any]]:
-        return self.db.fetch_one(
-            'SELECT * FROM prompt_versions WHERE prompt_id = ? ORDER BY version_number DESC LIMIT 1',
+        row = self.db.fetch_one(
+            f'SELECT {self._columns()} FROM prompt_versions WHERE prompt_id = ? ORDER BY version_number DESC LIMIT 1',
             (prompt_id,)
         )
+        return self._inflate([row])[0] if row else None
+
+    def diff(self, prompt_id: int, from_version_id: Optional[int], to_version_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        比较提示词的两个版本，版本 id 为 None 表示当前（最新）内容。
+        任一版本不存在或不属于该提示词时返回 None。
+        差异结果按 (版本 id, 版本 id) 缓存；当前内容以内容哈希作为键。
+        """
+        sides = []
+        for version_id in (from_version_id, to_version_id):
+            side = self._diff_side(prompt_id, version_id)
+            if side is None:
+                return None
+            sides.append(side)
+        
+        key = (sides[0]['key'], sides[1]['key'])
+        result = self._diff_cache.get(key)
+        if result is None:
+            result = diff_text(*(side['load']() for side in sides))
+            self._diff_cache.set(key, result)
+        
+        return {
+            'from': sides[0]['info'],
+            'to': sides[1]['info'],
+            'title_changed': sides[0]['info']['title'] != sides[1]['info']['title'],
+            **result
+        }
+
+    def _diff_side(self, prompt_id: int, version_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """读取差异一侧的元数据（不读内容），内容在缓存未命中时才通过 load 读取"""
+        if version_id is None:
+            prompt = self.db.fetch_one(
+                'SELECT title, content as stored, content_codec, updated_at FROM prompts WHERE id = ?',
+                (prompt_id,)
+            )
+            if not prompt:
+                return None
+            if prompt['content_codec'] == 'blob':
+                digest = prompt['stored']
+            else:
+                digest = content_hash(decode_content(prompt['stored'], prompt['content_codec']))
+            return {
+                'key': ('live', digest),
+                'info': {'version_id': None, 'title': prompt['title'], 'updated_at': prompt['updated_at']},
+                'load': lambda: self.db.fetch_one(
+                    f'SELECT {content_expr()} as content FROM prompts WHERE id = ?', (prompt_id,)
+                )['content']
+            }
+        
+        version = self.db.fetch_one(
+            '''SELECT id as version_id, version_number, version_name, title, created_at 
+               FROM prompt_versions WHERE id = ? AND prompt_id = ?''',
+            (version_id, prompt_id)
+        )
+        if not version:
+            return None
+        return {
+            'key': version_id,
+            'info': version,
+            'load': lambda: self.get_by_id(version_id)['content']
+        }
+
+    def get_contents(self, version_ids: List[int]) -> Dict[int, str]:
+        """按批读取多个版本的完整内容（增量存储的版本会被还原），返回 {version_id: content}"""
+        contents = {}
+        for i in range(0, len(version_ids), self.BATCH_SIZE):
+            batch = version_ids[i:i + self.BATCH_SIZE]
+            placeholders = ','.join(['?' for _ in batch])
+            versions = self.db.fetch_all(
+                f'''SELECT id, {content_expr()} as content, content_codec, base_version_id 
+                   FROM prompt_versions WHERE id IN ({placeholders})''',
+                tuple(batch)
+            )
+            for version in self._inflate(versions):
+                contents[version['id']] = version['content']
+        return contents
+
+    def snapshot(self, as_of: str, project_id: int = None, prompt_id: int = None) -> List[Dict[str, Any]]:
+        """
+        返回 as_of 时刻（北京时间字符串）项目下或单个提示词当时生效的内容。
+        每个版本保存的是被覆盖前的内容，因此 as_of 之后创建的第一个版本就是当时生效的内容；
+        之后没有版本时当时的内容就是当前内容（version_id 为 None）。as_of 时尚未创建的提示词不返回。
+        生效版本由一条按 (prompt_id, created_at) 索引查找的查询确定，只读取被选中版本的内容。
+        """
+        condition, param = ('p.id = ?', prompt_id) if prompt_id is not None else ('p.project_id = ?', project_id)
+        rows = self.db.fetch_all(
+            f'''SELECT p.id, p.project_id, COALESCE(v.title, p.title) as title, 
+                      CASE WHEN v.id IS NULL THEN {content_expr('p.')} END as content, 
+                      v.id as version_id, v.version_number, v.version_name, p.created_at 
+               FROM prompts p 
+               LEFT JOIN prompt_versions v ON v.id = (
+                   SELECT id FROM prompt_versions 
+                   WHERE prompt_id = p.id AND created_at > ? 
+                   ORDER BY created_at, version_number LIMIT 1
+               ) 
+               WHERE {condition} AND p.created_at <= ? 
+               ORDER BY p.created_at DESC, p.id DESC''',
+            (as_of, param, as_of)
+        )
+        
+        contents = self.get_contents([row['version_id'] for row in rows if row['version_id'] is not None])
+        for row in rows:
+            if row['version_id'] is not None:
+                row['content'] = contents[row['version_id']]
+        return rows
 
     def get_current_version_number(self, prompt_id: int) -> int:
         result = self.db.fetch_one(
@@ -417,16 +1866,130 @@ class PromptVersionModel:
         return result['max_version'] if result and result['max_version'] else 0
 
     def update_version_name(self, version_id: int, version_name: str) -> bool:
-        self.db.execute_query(
-            'UPDATE prompt_versions SET version_name = ? WHERE id = ?',
-            (version_name, version_id)
-        )
+        with self.db.transaction():
+            self.db.execute_query(
+                'UPDATE prompt_versions SET version_name = ? WHERE id = ?',
+                (version_name, version_id)
+            )
+            self._record_change(version_id, 'update')
         return True
 
     def delete(self, version_id: int) -> bool:
-        self.db.execute_query('DELETE FROM prompt_versions WHERE id = ?', (version_id,))
+        with self.db.transaction():
+            # 删除关键帧前，先把依赖它的增量版本改存为完整内容
+            dependents = self.db.fetch_all(
+                'SELECT id, content, content_codec, base_version_id FROM prompt_versions WHERE base_version_id = ?',
+                (version_id,)
+            )
+            for row in self._inflate(dependents):
+                self.db.execute_query(
+                    'UPDATE prompt_versions SET content = ?, content_codec = ?, base_version_id = NULL WHERE id = ?',
+                    (*self.db.store_content(row['content']), row['id'])
+                )
+            self._record_change(version_id, 'delete')
+            self.db.execute_query('DELETE FROM prompt_labels WHERE version_id = ?', (version_id,))
+            self.db.execute_query('DELETE FROM prompt_versions WHERE id = ?', (version_id,))
+        self._content_cache.pop(version_id)
         return True
 
+    def compact(self, prompt_id: int, codec: str = DEFAULT_CONTENT_CODEC) -> int:
+        """
+        把提示词的全部历史版本重新编码为“关键帧 + 增量”，关键帧存入 content_blobs（新正文按 codec 压缩），
+        返回改写的版本数
+        """
+        changed = 0
+        with self.db.transaction():
+            rows = self._inflate(self.db.fetch_all(
+                f'''SELECT id, {content_expr()} as content, content_codec, base_version_id FROM prompt_versions 
+                   WHERE prompt_id = ? ORDER BY version_number''',
+                (prompt_id,)
+            ))
+            stored_rows = {row['id']: row for row in self.db.fetch_all(
+                'SELECT id, content, content_codec, base_version_id FROM prompt_versions WHERE prompt_id = ?',
+                (prompt_id,)
+            )}
+            keyframe = None
+            followers = 0
+            for row in rows:
+                content = row['content']
+                encoded = None
+                if keyframe and followers < self.KEYFRAME_INTERVAL and len(content) >= self.DELTA_MIN_SIZE:
+                    delta = make_delta(keyframe['content'], content)
+                    if len(delta) * 2 <= len(content):
+                        encoded = (delta, 'delta', keyframe['id'])
+                        followers += 1
+                if encoded is None:
+                    encoded = (*self.db.store_content(content, codec), None)
+                    keyframe, followers = row, 0
+                
+                old = stored_rows[row['id']]
+                if (old['content'], old['content_codec'], old['base_version_id']) != encoded:
+                    self.db.execute_query(
+                        'UPDATE prompt_versions SET content = ?, content_codec = ?, base_version_id = ? WHERE id = ?',
+                        (*encoded, row['id'])
+                    )
+                    changed += 1
+        return changed
+
+
+class PromptLabelModel:
+    # 标签会出现在 /api/resolve 的 @label 中，不允许包含 @ 和 /
+    LABEL_PATTERN = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    @cached_query(lambda self, prompt_id: self.db.prompt_scope(prompt_id))
+    def get_all(self, prompt_id: int) -> List[Dict[str, Any]]:
+        return self.db.fetch_all(
+            '''SELECT l.label, l.version_id, v.version_number, v.version_name, l.updated_at 
+               FROM prompt_labels l 
+               JOIN prompt_versions v ON v.id = l.version_id 
+               WHERE l.prompt_id = ? ORDER BY l.label''',
+            (prompt_id,)
+        )
+
+    def get_version_id(self, prompt_id: int, label: str) -> Optional[int]:
+        row = self.db.fetch_one(
+            'SELECT version_id FROM prompt_labels WHERE prompt_id = ? AND label = ?',
+            (prompt_id, label)
+        )
+        return row['version_id'] if row else None
+
+    def set(self, prompt_id: int, label: str, version_id: int) -> bool:
+        """
+        把标签指向提示词的某个版本（不存在则创建），只写一行。
+        标签名不合法时抛出 ValueError；版本不属于该提示词时返回 False。
+        """
+        if not self.LABEL_PATTERN.fullmatch(label):
+            raise ValueError('标签只能包含字母、数字、_ . -，且不超过 64 个字符')
+        with self.db.transaction():
+            version = self.db.fetch_one(
+                'SELECT project_id FROM prompt_versions WHERE id = ? AND prompt_id = ?',
+                (version_id, prompt_id)
+            )
+            if not version:
+                return False
+            self.db.execute_query(
+                '''INSERT INTO prompt_labels (prompt_id, label, version_id, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(prompt_id, label) DO UPDATE SET version_id = excluded.version_id, 
+                                                               updated_at = excluded.updated_at''',
+                (prompt_id, label, version_id, now_beijing())
+            )
+            self.db.record_change(version['project_id'], 'label', prompt_id, 'update')
+        return True
+
+    def delete(self, prompt_id: int, label: str) -> bool:
+        with self.db.transaction():
+            cursor = self.db.execute_query(
+                'DELETE FROM prompt_labels WHERE prompt_id = ? AND label = ?',
+                (prompt_id, label)
+            )
+            if cursor.rowcount:
+                prompt = self.db.fetch_one('SELECT project_id FROM prompts WHERE id = ?', (prompt_id,))
+                self.db.record_change(prompt['project_id'] if prompt else None, 'label', prompt_id, 'delete')
+        return cursor.rowcount > 0
+
 
 class UserModel:
     def __init__(self, db: Database):
@@ -458,7 +2021,11 @@ class UserModel:
         )
 
     def delete(self, user_id: int) -> bool:
-        self.db.execute_query('DELETE FROM users WHERE id = ?', (user_id,))
+        with self.db.transaction():
+            self.db.execute_query('DELETE FROM users WHERE id = ?', (user_id,))
+            self.db.refresh_effective_permissions(user_id=user_id)
+            # 该用户的 API Key 认证缓存立即失效
+            self.db.bump_generation(ApiKeyModel.AUTH_SCOPE)
         return True
 
     def update_password(self, user_id: int, new_password: str) -> bool:
@@ -507,7 +2074,11 @@ class GroupModel:
         return True
 
     def delete(self, group_id: int) -> bool:
-        self.db.execute_query('DELETE FROM groups WHERE id = ?', (group_id,))
+        with self.db.transaction():
+            members = self.db.fetch_all('SELECT user_id FROM user_groups WHERE group_id = ?', (group_id,))
+            self.db.execute_query('DELETE FROM groups WHERE id = ?', (group_id,))
+            for member in members:
+                self.db.refresh_effective_permissions(user_id=member['user_id'])
         return True
 
 
@@ -517,17 +2088,21 @@ class UserGroupModel:
 
     def add_user_to_group(self, user_id: int, group_id: int) -> int:
         now = now_beijing()
-        cursor = self.db.execute_query(
-            'INSERT INTO user_groups (user_id, group_id, created_at) VALUES (?, ?, ?)',
-            (user_id, group_id, now)
-        )
+        with self.db.transaction():
+            cursor = self.db.execute_query(
+                'INSERT INTO user_groups (user_id, group_id, created_at) VALUES (?, ?, ?)',
+                (user_id, group_id, now)
+            )
+            self.db.refresh_effective_permissions(user_id=user_id)
         return cursor.lastrowid
 
     def remove_user_from_group(self, user_id: int, group_id: int) -> bool:
-        self.db.execute_query(
-            'DELETE FROM user_groups WHERE user_id = ? AND group_id = ?',
-            (user_id, group_id)
-        )
+        with self.db.transaction():
+            self.db.execute_query(
+                'DELETE FROM user_groups WHERE user_id = ? AND group_id = ?',
+                (user_id, group_id)
+            )
+            self.db.refresh_effective_permissions(user_id=user_id)
         return True
 
     def get_user_groups(self, user_id: int) -> List[Dict[str, Any]]:
@@ -556,23 +2131,36 @@ class ProjectPermissionModel:
 
     def grant_permission(self, project_id: int, user_id: int = None, group_id: int = None, level: str = 'readwrite') -> int:
         now = now_beijing()
-        cursor = self.db.execute_query(
-            'INSERT INTO project_permissions (project_id, user_id, group_id, permission_level, created_at) VALUES (?, ?, ?, ?, ?)',
-            (project_id, user_id, group_id, level, now)
-        )
+        with self.db.transaction():
+            cursor = self.db.execute_query(
+                'INSERT INTO project_permissions (project_id, user_id, group_id, permission_level, created_at) VALUES (?, ?, ?, ?, ?)',
+                (project_id, user_id, group_id, level, now)
+            )
+            self.db.refresh_effective_permissions(project_id=project_id)
         return cursor.lastrowid
 
     def update_permission_level(self, permission_id: int, level: str) -> bool:
-        self.db.execute_query(
-            'UPDATE project_permissions SET permission_level = ? WHERE id = ?',
-            (level, permission_id)
-        )
+        with self.db.transaction():
+            self.db.execute_query(
+                'UPDATE project_permissions SET permission_level = ? WHERE id = ?',
+                (level, permission_id)
+            )
+            self._refresh_permission_project(permission_id)
         return True
 
     def revoke_permission(self, permission_id: int) -> bool:
-        self.db.execute_query('DELETE FROM project_permissions WHERE id = ?', (permission_id,))
+        with self.db.transaction():
+            permission = self.db.fetch_one('SELECT project_id FROM project_permissions WHERE id = ?', (permission_id,))
+            self.db.execute_query('DELETE FROM project_permissions WHERE id = ?', (permission_id,))
+            if permission:
+                self.db.refresh_effective_permissions(project_id=permission['project_id'])
         return True
 
+    def _refresh_permission_project(self, permission_id: int):
+        permission = self.db.fetch_one('SELECT project_id FROM project_permissions WHERE id = ?', (permission_id,))
+        if permission:
+            self.db.refresh_effective_permissions(project_id=permission['project_id'])
+
     def get_project_permissions(self, project_id: int) -> List[Dict[str, Any]]:
         return self.db.fetch_all(
             '''SELECT pp.*, u.username, g.name as group_name 
@@ -586,38 +2174,53 @@ class ProjectPermissionModel:
 
     def get_user_projects(self, user_id: int) -> List[Dict[str, Any]]:
         return self.db.fetch_all(
-            '''SELECT DISTINCT p.* FROM projects p 
-               LEFT JOIN project_permissions pp ON p.id = pp.project_id 
-               LEFT JOIN user_groups ug ON pp.group_id = ug.group_id 
-               WHERE pp.user_id = ? OR ug.user_id = ? 
+            '''SELECT p.* FROM projects p 
+               JOIN effective_permissions ep ON p.id = ep.project_id 
+               WHERE ep.user_id = ? 
                ORDER BY p.created_at DESC''',
-            (user_id, user_id)
+            (user_id,)
         )
 
     def check_user_project_permission(self, user_id: int, project_id: int) -> bool:
+        return self.get_user_permission_level(user_id, project_id) is not None
+
+    def get_user_permission_level(self, user_id: int, project_id: int) -> Optional[str]:
+        """返回用户对项目的权限级别（'readwrite' 或 'read'），无权限时返回 None"""
         result = self.db.fetch_one(
-            '''SELECT COUNT(*) as count FROM project_permissions pp 
-               LEFT JOIN user_groups ug ON pp.group_id = ug.group_id 
-               WHERE pp.project_id = ? AND (pp.user_id = ? OR ug.user_id = ?)''',
-            (project_id, user_id, user_id)
+            'SELECT level FROM effective_permissions WHERE user_id = ? AND project_id = ?',
+            (user_id, project_id)
         )
-        return result['count'] > 0 if result else False
+        return result['level'] if result else None
 
     def check_user_can_write(self, user_id: int, project_id: int) -> bool:
         """检查用户对项目是否有写权限（直接授权或通过用户组）"""
-        result = self.db.fetch_one(
-            '''SELECT COUNT(*) as count FROM project_permissions pp 
-               LEFT JOIN user_groups ug ON pp.group_id = ug.group_id 
-               WHERE pp.project_id = ? AND (pp.user_id = ? OR ug.user_id = ?)
-               AND pp.permission_level = 'readwrite' ''',
-            (project_id, user_id, user_id)
-        )
-        return result['count'] > 0 if result else False
+        return self.get_user_permission_level(user_id, project_id) == 'readwrite'
 
 
 class ApiKeyModel:
-    def __init__(self, db: Database):
+    # API Key 认证缓存的失效作用域：删除 Key 或用户时递增
+    AUTH_SCOPE = 'auth'
+
+    def __init__(self, db: Database, cache_size: int = 1024, cache_ttl: float = 60.0,
+                 usage_precision: float = 60.0, usage_flush_interval: float = 30.0):
+        """
+        last_used_at 不再每次请求都写库：使用时间先记录在内存中，
+        同一个 Key 在 usage_precision 秒内只记录一次，由后台线程每隔
+        usage_flush_interval 秒批量写入，进程退出时调用 close() 写入剩余记录。
+        """
         self.db = db
+        # key_hash -> (缓存时的代数, 用户信息)
+        self._auth_cache = LRUCache(cache_size, cache_ttl)
+        self.usage_precision = usage_precision
+        self._pending_usage: Dict[int, str] = {}
+        self._last_recorded: Dict[int, float] = {}
+        self._usage_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        if usage_flush_interval > 0:
+            threading.Thread(
+                target=self._flush_loop, args=(usage_flush_interval,),
+                name='api-key-usage-flush', daemon=True,
+            ).start()
 
     def create(self, user_id: int, name: str) -> tuple:
         import secrets
@@ -632,16 +2235,30 @@ class ApiKeyModel:
         return cursor.lastrowid, api_key
 
     def get_user_keys(self, user_id: int) -> List[Dict[str, Any]]:
-        return self.db.fetch_all(
+        keys = self.db.fetch_all(
             'SELECT id, name, last_used_at, created_at FROM api_keys WHERE user_id = ? ORDER BY created_at DESC',
             (user_id,)
         )
+        # 合并本进程中尚未写入数据库的使用时间
+        with self._usage_lock:
+            for key in keys:
+                pending = self._pending_usage.get(key['id'])
+                if pending and (not key['last_used_at'] or pending > key['last_used_at']):
+                    key['last_used_at'] = pending
+        return keys
 
     def get_by_id(self, key_id: int) -> Optional[Dict[str, Any]]:
         return self.db.fetch_one('SELECT * FROM api_keys WHERE id = ?', (key_id,))
 
     def get_user_by_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """通过 API Key 查找用户，命中缓存时不访问数据库"""
         key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        generation = self.db.get_generation(self.AUTH_SCOPE)
+        cached = self._auth_cache.get(key_hash)
+        if cached is not None and cached[0] == generation:
+            self.record_usage(cached[1]['id'])
+            return dict(cached[1])
+        
         result = self.db.fetch_one(
             '''SELECT ak.*, u.id as user_id, u.username, u.is_admin 
                FROM api_keys ak 
@@ -651,19 +2268,69 @@ class ApiKeyModel:
         )
         
         if result:
-            self.db.execute_query(
-                'UPDATE api_keys SET last_used_at = ? WHERE id = ?',
-                (now_beijing(), result['id'])
-            )
+            self.record_usage(result['id'])
+            self._auth_cache.set(key_hash, (generation, dict(result)))
         
         return result
 
+    def record_usage(self, key_id: int):
+        """在内存中记录 Key 的使用时间，精度为 usage_precision 秒"""
+        now = time.monotonic()
+        with self._usage_lock:
+            last = self._last_recorded.get(key_id)
+            if last is not None and now - last < self.usage_precision:
+                return
+            self._last_recorded[key_id] = now
+            self._pending_usage[key_id] = now_beijing()
+
+    def flush_usage(self) -> int:
+        """将缓冲的使用时间在一个事务中批量写入数据库，返回写入的 Key 数量"""
+        with self._usage_lock:
+            pending, self._pending_usage = self._pending_usage, {}
+        if not pending:
+            return 0
+        
+        try:
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    'UPDATE api_keys SET last_used_at = ? WHERE id = ?',
+                    [(used_at, key_id) for key_id, used_at in pending.items()]
+                )
+        except sqlite3.Error:
+            # 写入失败时放回缓冲区，保留较新的时间，下次再试
+            with self._usage_lock:
+                for key_id, used_at in pending.items():
+                    if used_at > self._pending_usage.get(key_id, ''):
+                        self._pending_usage[key_id] = used_at
+            raise
+        return len(pending)
+
+    def _flush_loop(self, interval: float):
+        while not self._stop_event.wait(interval):
+            try:
+                self.flush_usage()
+            except sqlite3.Error:
+                pass
+            finally:
+                self.db.release_connection()
+
+    def close(self):
+        """停止后台写入线程并写入剩余的使用记录（进程退出时调用）"""
+        self._stop_event.set()
+        self.flush_usage()
+
     def delete(self, key_id: int) -> bool:
         self.db.execute_query('DELETE FROM api_keys WHERE id = ?', (key_id,))
+        self.db.bump_generation(self.AUTH_SCOPE)
+        with self._usage_lock:
+            self._pending_usage.pop(key_id, None)
+            self._last_recorded.pop(key_id, None)
         return True
 
 
 class TagModel:
+    BATCH_SIZE = 500
+
     def __init__(self, db: Database):
         self.db = db
 
@@ -678,12 +2345,20 @@ class TagModel:
         if existing:
             return existing['id']
         # 创建新标签
-        cursor = self.db.execute_query(
-            'INSERT INTO tags (project_id, name, active, created_at) VALUES (?, ?, 1, ?)',
-            (project_id, name, now)
-        )
+        with self.db.transaction():
+            cursor = self.db.execute_query(
+                'INSERT INTO tags (project_id, name, active, created_at) VALUES (?, ?, 1, ?)',
+                (project_id, name, now)
+            )
+            self.db.record_change(project_id, 'tag', cursor.lastrowid, 'create')
         return cursor.lastrowid
 
+    def _record_change(self, tag_id: int, entity: str, entity_id: int, action: str):
+        row = self.db.fetch_one('SELECT project_id FROM tags WHERE id = ?', (tag_id,))
+        if row:
+            self.db.record_change(row['project_id'], entity, entity_id, action)
+
+    @cached_query(lambda self, project_id: project_scope(project_id))
     def get_project_tags(self, project_id: int) -> List[Dict[str, Any]]:
         """只返回活跃的标签"""
         return self.db.fetch_all(
@@ -691,6 +2366,7 @@ class TagModel:
             (project_id,)
         )
 
+    @cached_query(lambda self, prompt_id: self.db.prompt_scope(prompt_id))
     def get_prompt_tags(self, prompt_id: int) -> List[Dict[str, Any]]:
         return self.db.fetch_all(
             '''SELECT t.* FROM tags t
@@ -700,24 +2376,49 @@ class TagModel:
             (prompt_id,)
         )
 
+    def get_tags_for_prompts(self, prompt_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """批量获取多个提示词的标签，返回 {prompt_id: [tag, ...]}，查询次数与提示词数量无关"""
+        result = {prompt_id: [] for prompt_id in prompt_ids}
+        ids = list(result)
+        # 分批绑定参数，避免超过 SQLite 的变量数量上限
+        for start in range(0, len(ids), self.BATCH_SIZE):
+            batch = ids[start:start + self.BATCH_SIZE]
+            placeholders = ','.join(['?' for _ in batch])
+            rows = self.db.fetch_all(
+                f'''SELECT pt.prompt_id AS _prompt_id, t.* FROM tags t
+                    JOIN prompt_tags pt ON t.id = pt.tag_id
+                    WHERE pt.prompt_id IN ({placeholders}) AND t.active = 1
+                    ORDER BY t.name''',
+                tuple(batch)
+            )
+            for row in rows:
+                result[row.pop('_prompt_id')].append(row)
+        return result
+
     def add_tag_to_prompt(self, prompt_id: int, tag_id: int) -> bool:
         now = now_beijing()
         try:
-            self.db.execute_query(
-                'INSERT OR IGNORE INTO prompt_tags (prompt_id, tag_id, created_at) VALUES (?, ?, ?)',
-                (prompt_id, tag_id, now)
-            )
+            with self.db.transaction():
+                cursor = self.db.execute_query(
+                    'INSERT OR IGNORE INTO prompt_tags (prompt_id, tag_id, created_at) VALUES (?, ?, ?)',
+                    (prompt_id, tag_id, now)
+                )
+                if cursor.rowcount:
+                    self._record_change(tag_id, 'prompt_tag', prompt_id, 'create')
             return True
         except Exception:
             return False
 
     def remove_tag_from_prompt(self, prompt_id: int, tag_id: int) -> bool:
-        self.db.execute_query(
-            'DELETE FROM prompt_tags WHERE prompt_id = ? AND tag_id = ?',
-            (prompt_id, tag_id)
-        )
-        # 检查该标签是否还有关联的提示词，如果没有则标记为失效
-        self._deactivate_if_orphan(tag_id)
+        with self.db.transaction():
+            cursor = self.db.execute_query(
+                'DELETE FROM prompt_tags WHERE prompt_id = ? AND tag_id = ?',
+                (prompt_id, tag_id)
+            )
+            if cursor.rowcount:
+                self._record_change(tag_id, 'prompt_tag', prompt_id, 'delete')
+            # 检查该标签是否还有关联的提示词，如果没有则标记为失效
+            self._deactivate_if_orphan(tag_id)
         return True
 
     def _deactivate_if_orphan(self, tag_id: int):
@@ -727,22 +2428,108 @@ class TagModel:
             (tag_id,)
         )
         if result and result['count'] == 0:
-            self.db.execute_query(
-                'UPDATE tags SET active = 0 WHERE id = ?',
+            cursor = self.db.execute_query(
+                'UPDATE tags SET active = 0 WHERE id = ? AND active = 1',
                 (tag_id,)
             )
+            if cursor.rowcount:
+                self._record_change(tag_id, 'tag', tag_id, 'update')
 
     def delete(self, tag_id: int) -> bool:
-        self.db.execute_query('DELETE FROM tags WHERE id = ?', (tag_id,))
+        with self.db.transaction():
+            self._record_change(tag_id, 'tag', tag_id, 'delete')
+            self.db.execute_query('DELETE FROM tags WHERE id = ?', (tag_id,))
         return True
 
-    def get_prompts_by_tags(self, project_id: int, tag_ids: List[int]) -> List[Dict[str, Any]]:
+    def get_prompts_by_tags(self, project_id: int, tag_ids: List[int], fields: List[str] = None) -> List[Dict[str, Any]]:
         """获取拥有任意一个指定标签的提示词（并集）"""
         placeholders = ','.join(['?' for _ in tag_ids])
+        columns = select_fields(fields, PromptModel.COLUMNS, required=('id', 'created_at'), alias='p.')
         return self.db.fetch_all(
-            f'''SELECT DISTINCT p.* FROM prompts p
+            f'''SELECT DISTINCT {columns} FROM prompts p
                 JOIN prompt_tags pt ON p.id = pt.prompt_id
                 WHERE p.project_id = ? AND pt.tag_id IN ({placeholders})
                 ORDER BY p.created_at DESC''',
             (project_id, *tag_ids)
         )
+
+
+class ChangeModel:
+    def __init__(self, db: Database):
+        self.db = db
+
+    def latest_cursor(self) -> str:
+        """指向最新一条变更的游标，从这里开始只会读到之后提交的变更"""
+        row = self.db.fetch_one('SELECT MAX(id) AS id FROM changes')
+        return encode_cursor(row['id'] or 0)
+
+    def get_since(self, cursor: Optional[str], limit: int, project_id: int = None,
+                  user_id: int = None) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        返回游标之后的变更（按 id 升序）和新的游标；没有新变更时原样返回游标，客户端保存后继续轮询。
+        cursor 为空时从头开始。指定 user_id 时只返回该用户可读项目的变更，以及该用户在删除前
+        可读的项目被删除的通知（删除项目时权限已一并清除）。无论哪种过滤条件，空轮询都只是一次索引查询。
+        """
+        since = decode_cursor(cursor, 1)[0] if cursor else 0
+        if not isinstance(since, int):
+            raise ValueError('无效的分页游标')
+
+        conditions = ['id > ?']
+        params = [since]
+        last = None
+        if project_id is not None:
+            conditions.append('project_id = ?')
+            params.append(project_id)
+        if user_id is not None:
+            # 按权限过滤时其他项目的变更不会出现在结果中，先取当前最大 id 作为上界，
+            # 本页不满时游标直接推进到上界，避免每次轮询都重新扫描这些变更
+            last = self.db.fetch_one('SELECT MAX(id) AS id FROM changes')['id'] or 0
+            if last <= since:
+                return [], cursor or encode_cursor(since)
+            conditions.append('id <= ?')
+            params.append(last)
+            conditions.append('''(project_id IN (SELECT project_id FROM effective_permissions WHERE user_id = ?)
+                                  OR id IN (SELECT change_id FROM change_readers WHERE user_id = ? AND change_id > ?))''')
+            params.extend((user_id, user_id, since))
+        params.append(limit)
+
+        changes = self.db.fetch_all(
+            f'''SELECT id, project_id, entity, entity_id, action, created_at FROM changes
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id LIMIT ?''',
+            tuple(params)
+        )
+        if last is not None and len(changes) < limit:
+            return changes, encode_cursor(last)
+        next_cursor = encode_cursor(changes[-1]['id']) if changes else (cursor or encode_cursor(since))
+        return changes, next_cursor
+
+    def get_readers(self, changes: List[Dict[str, Any]]) -> Dict[int, Set[int]]:
+        """
+        返回 {变更 id: 可读该变更的用户 id 集合}，判断方式与 get_since(user_id=...) 相同：
+        项目当前的有效权限，加上删除项目时记录在 change_readers 中的用户。查询次数与变更数量无关。
+        返回的集合可能被同一项目的多条变更共用，调用方不应修改。
+        """
+        if not changes:
+            return {}
+        project_ids = sorted({change['project_id'] for change in changes})
+        placeholders = ','.join(['?' for _ in project_ids])
+        by_project: Dict[int, Set[int]] = {project_id: set() for project_id in project_ids}
+        for row in self.db.fetch_all(
+            f'SELECT user_id, project_id FROM effective_permissions WHERE project_id IN ({placeholders})',
+            tuple(project_ids)
+        ):
+            by_project[row['project_id']].add(row['user_id'])
+        readers = {change['id']: by_project[change['project_id']] for change in changes}
+
+        deleted = [change['id'] for change in changes if change['entity'] == 'project' and change['action'] == 'delete']
+        if deleted:
+            placeholders = ','.join(['?' for _ in deleted])
+            for change_id in deleted:
+                readers[change_id] = set(readers[change_id])
+            for row in self.db.fetch_all(
+                f'SELECT user_id, change_id FROM change_readers WHERE change_id IN ({placeholders})',
+                tuple(deleted)
+            ):
+                readers[row['change_id']].add(row['user_id'])
+        return readers
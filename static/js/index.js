@@ -162,11 +162,13 @@ async function checkCanDeleteProject() {
 
 async function loadPrompts() {
     try {
+        // 列表只展示标题、标签和内容摘要，不下载完整内容
+        const fields = 'fields=title,preview,tags';
         let url;
         if (selectedTagIds.length > 0 && currentProjectId) {
-            url = `/api/projects/${currentProjectId}/prompts-by-tags?tag_ids=${selectedTagIds.join(',')}`;
+            url = `/api/projects/${currentProjectId}/prompts-by-tags?tag_ids=${selectedTagIds.join(',')}&${fields}`;
         } else {
-            url = currentProjectId ? `/api/prompts?project_id=${currentProjectId}` : '/api/prompts';
+            url = currentProjectId ? `/api/prompts?project_id=${currentProjectId}&${fields}` : `/api/prompts?${fields}`;
         }
         const response = await fetch(url);
         const result = await response.json();
@@ -199,7 +201,7 @@ function renderPrompts() {
         
         div.innerHTML = `
             <h3>${escapeHtml(prompt.title)}</h3>
-            <p>${escapeHtml(prompt.content)}</p>
+            <p>${escapeHtml(prompt.preview)}</p>
             ${tagsHtml}
         `;
         promptList.appendChild(div);
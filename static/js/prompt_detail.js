@@ -6,21 +6,30 @@ let selectedVersionId = null;
 let promptTags = [];
 let projectTags = [];
 
+// 详情页数据（提示词、标签、项目标签、版本摘要、当前用户）通过一个接口获取，
+// 未变化时服务器返回 304，浏览器直接使用缓存
+async function fetchView() {
+    const response = await fetch(`/api/prompts/${promptId}/view`);
+    const result = await response.json();
+    if (!result.success) {
+        throw new Error(result.error || '加载提示词失败');
+    }
+    return result.data;
+}
+
 async function loadPrompt() {
     try {
-        const response = await fetch(`/api/prompts/${promptId}`);
-        const result = await response.json();
-        
-        if (result.success) {
-            promptData = result.data;
-            displayPrompt();
-            loadVersions();
-            loadPromptTags();
-            loadProjectTags();
-        } else {
-            alert('加载提示词失败');
-            window.location.href = '/';
-        }
+        const view = await fetchView();
+        promptData = view.prompt;
+        promptTags = view.tags;
+        projectTags = view.project_tags;
+        versions = view.versions;
+        selectedVersionId = null;
+        renderCurrentUser(view.user);
+        displayPrompt();
+        displayVersions();
+        renderPromptTags();
+        renderExistingTagsList();
     } catch (error) {
         console.error('加载提示词失败:', error);
         alert('加载提示词失败');
@@ -28,33 +37,18 @@ async function loadPrompt() {
     }
 }
 
-async function loadPromptTags() {
+async function loadTags() {
     try {
-        const response = await fetch(`/api/prompts/${promptId}/tags`);
-        const result = await response.json();
-        if (result.success) {
-            promptTags = result.data;
-            renderPromptTags();
-        }
+        const view = await fetchView();
+        promptTags = view.tags;
+        projectTags = view.project_tags;
+        renderPromptTags();
+        renderExistingTagsList();
     } catch (error) {
         console.error('加载标签失败:', error);
     }
 }
 
-async function loadProjectTags() {
-    if (!promptData) return;
-    try {
-        const response = await fetch(`/api/projects/${promptData.project_id}/tags`);
-        const result = await response.json();
-        if (result.success) {
-            projectTags = result.data;
-            renderExistingTagsList();
-        }
-    } catch (error) {
-        console.error('加载项目标签失败:', error);
-    }
-}
-
 function renderPromptTags() {
     const tagList = document.getElementById('promptTagList');
     tagList.innerHTML = '';
@@ -99,8 +93,7 @@ async function addTag(tagName) {
         });
         const result = await response.json();
         if (result.success) {
-            loadPromptTags();
-            loadProjectTags();
+            loadTags();
         } else {
             alert(result.error || '添加标签失败');
         }
@@ -116,8 +109,7 @@ async function removeTag(tagId) {
         });
         const result = await response.json();
         if (result.success) {
-            loadPromptTags();
-            loadProjectTags();
+            loadTags();
         }
     } catch (error) {
         console.error('移除标签失败:', error);
@@ -126,19 +118,27 @@ async function removeTag(tagId) {
 
 async function loadVersions() {
     try {
-        const response = await fetch(`/api/prompts/${promptId}/versions`);
-        const result = await response.json();
-        
-        if (result.success) {
-            versions = result.data;
-            selectedVersionId = null;
-            displayVersions();
-        }
+        const view = await fetchView();
+        versions = view.versions;
+        selectedVersionId = null;
+        displayVersions();
     } catch (error) {
         console.error('加载版本失败:', error);
     }
 }
 
+// 版本列表只包含摘要，内容按版本 id 获取；版本内容不可变，浏览器会长期缓存
+async function loadVersionContent(version) {
+    if (version.content === undefined) {
+        const response = await fetch(`/api/versions/${version.id}/content`);
+        if (!response.ok) {
+            throw new Error('加载版本内容失败');
+        }
+        version.content = await response.text();
+    }
+    return version.content;
+}
+
 function displayVersions() {
     const versionList = document.getElementById('versionList');
     versionList.innerHTML = '';
@@ -192,13 +192,21 @@ function selectLatestVersion() {
     displayPrompt();
 }
 
-function selectVersion(versionId) {
+async function selectVersion(versionId) {
     selectedVersionId = versionId;
     displayVersions();
     
     const version = versions.find(v => v.id === versionId);
     if (version) {
-        displayVersion(version);
+        try {
+            await loadVersionContent(version);
+        } catch (error) {
+            console.error('加载版本内容失败:', error);
+            return;
+        }
+        if (selectedVersionId === versionId) {
+            displayVersion(version);
+        }
     }
 }
 
@@ -322,12 +330,13 @@ async function restoreVersion(versionId) {
     const version = versions.find(v => v.id === versionId);
     if (version) {
         try {
+            const content = await loadVersionContent(version);
             const response = await fetch(`/api/prompts/${promptId}`, {
                 method: 'PUT',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ 
                     title: version.title, 
-                    content: version.content 
+                    content: content 
                 })
             });
             const result = await response.json();
@@ -424,20 +433,11 @@ function escapeHtml(text) {
     return div.innerHTML;
 }
 
-async function loadCurrentUser() {
-    try {
-        const response = await fetch('/api/current-user');
-        const result = await response.json();
-        if (result.success) {
-            const userSpan = document.getElementById('currentUser');
-            userSpan.innerHTML = `<a href="/profile" style="color: #4CAF50; text-decoration: none; font-weight: 500;">${result.data.username}</a>`;
-        }
-    } catch (error) {
-        console.error('获取当前用户失败:', error);
-    }
+function renderCurrentUser(user) {
+    const userSpan = document.getElementById('currentUser');
+    userSpan.innerHTML = `<a href="/profile" style="color: #4CAF50; text-decoration: none; font-weight: 500;">${user.username}</a>`;
 }
 
-loadCurrentUser();
 loadPrompt();
 
 // Tag input handler
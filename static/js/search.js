@@ -25,7 +25,7 @@ async function performSearch(query) {
     resultsDiv.innerHTML = '<p style="color: #999; text-align: center; margin-top: 40px;">搜索中...</p>';
     
     try {
-        const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
+        const response = await fetch(`/api/search?q=${encodeURIComponent(query)}&fields=title,preview,project_name,updated_at`);
         const result = await response.json();
         
         if (result.success) {
@@ -58,7 +58,7 @@ function renderResults(data, query) {
         div.onclick = () => window.open(`/prompt/${prompt.id}`, '_blank');
         
         const highlightedTitle = highlightText(prompt.title, keywords);
-        const highlightedContent = highlightText(truncateText(prompt.content, 200), keywords);
+        const highlightedContent = highlightText(truncateText(prompt.preview, 200), keywords);
         
         div.innerHTML = `
             <h3>${highlightedTitle}</h3>
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from models import Database, ProjectModel, PromptModel, PromptVersionModel
+
+PROCESSES = 4
+UPDATES_PER_PROCESS = 25
+
+
+def edit_prompt(db_path: str, prompt_id: int, worker: int):
+    """在独立进程中反复带版本地更新同一个提示词，返回 (创建的版本号, 出现的数据库错误)"""
+    db = Database(db_path, production=True)
+    prompts = PromptModel(db)
+    versions = []
+    errors = []
+    try:
+        for i in range(UPDATES_PER_PROCESS):
+            try:
+                versions.append(prompts.update_with_version(prompt_id, content=f'worker {worker} edit {i}'))
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            db.release_connection()
+    finally:
+        db.close()
+    return versions, errors
+
+
+class MultiProcessWriteTest(unittest.TestCase):
+    """多个 worker 进程共享同一个 WAL 数据库时，并发写入排队完成，版本号不重复"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'prompts.db')
+        db = Database(self.db_path, production=True)
+        project_id = ProjectModel(db).create('项目')
+        self.prompt_id = PromptModel(db).create(project_id, '标题', '内容')
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_concurrent_update_with_version(self):
+        with multiprocessing.Pool(PROCESSES) as pool:
+            results = pool.starmap(edit_prompt, [(self.db_path, self.prompt_id, n) for n in range(PROCESSES)])
+
+        errors = [e for _, worker_errors in results for e in worker_errors]
+        self.assertEqual(errors, [])
+        numbers = [v for worker_versions, _ in results for v in worker_versions]
+        total = PROCESSES * UPDATES_PER_PROCESS
+        self.assertEqual(sorted(numbers), list(range(1, total + 1)))
+
+        db = Database(self.db_path, production=True)
+        try:
+            self.assertEqual(db.fetch_one('PRAGMA journal_mode')['journal_mode'], 'wal')
+            stored = [v['version_number'] for v in PromptVersionModel(db).get_all(self.prompt_id)]
+            self.assertEqual(sorted(stored), list(range(1, total + 1)))
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
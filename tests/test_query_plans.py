@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from models import (Database, ProjectModel, ProjectPermissionModel, PromptModel,
+                    PromptVersionModel, TagModel, UserModel)
+
+
+class QueryPlanTest(unittest.TestCase):
+    """热点查询必须走索引：记录各方法实际执行的 SELECT，逐条检查 EXPLAIN QUERY PLAN 中没有 SCAN"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.tmpdir, 'prompts.db'))
+        self.project_id = ProjectModel(self.db).create('项目')
+        self.user_id = UserModel(self.db).create('user', 'password')
+        prompts = PromptModel(self.db)
+        self.prompt_id = prompts.create(self.project_id, '标题', '内容')
+        prompts.update_with_version(self.prompt_id, content='新内容')
+        tags = TagModel(self.db)
+        self.tag_ids = [tags.create(self.project_id, name) for name in ('a', 'b')]
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def assert_no_scan(self, call):
+        conn = self.db.get_connection()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+        selects = [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+            scans = [step for step in plan if step.startswith('SCAN')]
+            self.assertEqual(scans, [], f'{sql}\n{plan}')
+
+    def test_prompt_get_page(self):
+        self.assert_no_scan(lambda: PromptModel(self.db).get_page(self.project_id))
+
+    def test_version_get_page(self):
+        self.assert_no_scan(lambda: PromptVersionModel(self.db).get_page(self.prompt_id))
+
+    def test_get_current_version_number(self):
+        self.assert_no_scan(lambda: PromptVersionModel(self.db).get_current_version_number(self.prompt_id))
+
+    def test_get_user_permission_level(self):
+        self.assert_no_scan(
+            lambda: ProjectPermissionModel(self.db).get_user_permission_level(self.user_id, self.project_id)
+        )
+
+    def test_get_prompts_by_tags(self):
+        self.assert_no_scan(lambda: TagModel(self.db).get_prompts_by_tags(self.project_id, self.tag_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
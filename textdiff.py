@@ -0,0 +1,173 @@
+import re
+from typing import Any, Dict, List, Sequence, Tuple
+
+# 编辑距离超过此值时不再细分，剩余部分整体视为替换，保证超长且差异很大的文本也能快速返回
+MAX_EDIT_DISTANCE = 1000
+# 被替换的片段不超过此字符数时才计算词级差异
+WORD_DIFF_MAX_CHARS = 10000
+
+# 英文按单词、空白按连续段切分，中日韩文字和标点逐字切分
+_TOKEN_RE = re.compile(r'[^\W\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+|\s+|.', re.S)
+
+
+def diff_opcodes(a: Sequence, b: Sequence) -> List[Tuple[str, int, int, int, int]]:
+    """
+    计算把 a 变为 b 的操作序列，格式与 difflib.SequenceMatcher.get_opcodes() 相同。
+    先去掉公共前缀和后缀，中间部分使用 Myers O(ND) 算法：耗时与差异大小成正比，
+    长文本只改动几行时也很快。
+    """
+    n, m = len(a), len(b)
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+
+    # 元素映射为整数，加快比较
+    ids = {}
+    mid_a = [ids.setdefault(x, len(ids)) for x in a[prefix:n - suffix]]
+    mid_b = [ids.setdefault(x, len(ids)) for x in b[prefix:m - suffix]]
+
+    opcodes = []
+    if prefix:
+        opcodes.append(('equal', 0, prefix, 0, prefix))
+    for tag, i1, i2, j1, j2 in _myers(mid_a, mid_b):
+        opcodes.append((tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix))
+    if suffix:
+        opcodes.append(('equal', n - suffix, n, m - suffix, m))
+    return opcodes
+
+
+def _myers(a: List[int], b: List[int]) -> List[Tuple[str, int, int, int, int]]:
+    n, m = len(a), len(b)
+    if not n and not m:
+        return []
+    if not n or not m:
+        return [('insert' if not n else 'delete', 0, n, 0, m)]
+
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, MAX_EDIT_DISTANCE) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return [('replace', 0, n, 0, m)]
+
+
+def _backtrack(trace: List[Dict[int, int]], n: int, m: int) -> List[Tuple[str, int, int, int, int]]:
+    """根据每一轮的 V 数组回溯出编辑路径，并合并为操作序列"""
+    steps = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            steps.append(('equal', x, y))
+        if x == prev_x:
+            y -= 1
+            steps.append(('insert', x, y))
+        else:
+            x -= 1
+            steps.append(('delete', x, y))
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        steps.append(('equal', x, y))
+    steps.reverse()
+
+    opcodes = []
+    for op, x, y in steps:
+        if op == 'equal':
+            i1, i2, j1, j2 = x, x + 1, y, y + 1
+        elif op == 'delete':
+            i1, i2, j1, j2 = x, x + 1, y, y
+        else:
+            i1, i2, j1, j2 = x, x, y, y + 1
+        tag = 'equal' if op == 'equal' else 'replace'
+        if opcodes and (opcodes[-1][0] == 'equal') == (tag == 'equal'):
+            last = opcodes[-1]
+            opcodes[-1] = (last[0], last[1], i2, last[3], j2)
+        else:
+            opcodes.append((tag, i1, i2, j1, j2))
+
+    # 只删不增或只增不删的片段标记为 delete / insert
+    return [
+        ('delete' if j1 == j2 else 'insert' if i1 == i2 else tag, i1, i2, j1, j2)
+        if tag == 'replace' else (tag, i1, i2, j1, j2)
+        for tag, i1, i2, j1, j2 in opcodes
+    ]
+
+
+def diff_words(old: str, new: str) -> List[List[str]]:
+    """词级差异：返回 [操作, 文本] 列表，操作为 '='（相同）、'-'（删除）、'+'（新增）"""
+    a = _TOKEN_RE.findall(old)
+    b = _TOKEN_RE.findall(new)
+    result = []
+
+    def emit(op, tokens):
+        text = ''.join(tokens)
+        if not text:
+            return
+        if result and result[-1][0] == op:
+            result[-1][1] += text
+        else:
+            result.append([op, text])
+
+    for tag, i1, i2, j1, j2 in diff_opcodes(a, b):
+        if tag == 'equal':
+            emit('=', a[i1:i2])
+        else:
+            emit('-', a[i1:i2])
+            emit('+', b[j1:j2])
+    return result
+
+
+def diff_text(old: str, new: str) -> Dict[str, Any]:
+    """
+    逐行比较两段文本，返回结构化差异：
+    chunks 中相同的片段只给出起始行号和行数，删除、新增的片段给出对应行，
+    替换的片段另外给出词级差异 words（片段过长时为 None）。行号从 0 开始。
+    """
+    a = old.splitlines()
+    b = new.splitlines()
+    chunks = []
+    added = removed = 0
+
+    for tag, i1, i2, j1, j2 in diff_opcodes(a, b):
+        chunk = {'type': tag, 'from_start': i1, 'to_start': j1}
+        if tag == 'equal':
+            chunk['count'] = i2 - i1
+        else:
+            removed += i2 - i1
+            added += j2 - j1
+            if tag != 'insert':
+                chunk['from_lines'] = a[i1:i2]
+            if tag != 'delete':
+                chunk['to_lines'] = b[j1:j2]
+            if tag == 'replace':
+                old_part = '\n'.join(a[i1:i2])
+                new_part = '\n'.join(b[j1:j2])
+                chunk['words'] = (diff_words(old_part, new_part)
+                                  if len(old_part) + len(new_part) <= WORD_DIFF_MAX_CHARS else None)
+        chunks.append(chunk)
+
+    return {'stats': {'added': added, 'removed': removed}, 'chunks': chunks}